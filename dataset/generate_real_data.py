@@ -5,46 +5,106 @@
 
 import numpy as np
 import csv
+import gzip
+import shutil
 import argparse
 import yaml
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from utils import save_data, parse_path
+from utils import save_data, parse_path, run_tasks
+
+
+# the name of the processed file (bucket) containing the block
+def bucket_name(block_number, number_of_files):
+    slot = (block_number - 11000000) / 1000000 * number_of_files
+    start_block = 11000000 + int(slot) * 1000000 / number_of_files
+    end_block = start_block + 1000000 / number_of_files - 1
+    return "block_{}_to_{}.csv".format(int(start_block), int(end_block))
+
+
+# a bounded pool of open csv writers with large buffers, one per bucket file,
+# the least recently used writer is closed when the pool is full
+class BucketWriters:
+    def __init__(self, root_path, max_open=64, buffering=1 << 20):
+        self.root_path = root_path
+        self.max_open = max_open
+        self.buffering = buffering
+        self.files = OrderedDict()      # bucket name : (file, csv writer)
+
+    def writerow(self, name, row):
+        if name in self.files:
+            self.files.move_to_end(name)
+        else:
+            if len(self.files) >= self.max_open:
+                self.files.popitem(last=False)[1][0].close()
+            dest_file = open(self.root_path / name, "a", newline='', buffering=self.buffering)
+            self.files[name] = (dest_file, csv.writer(dest_file, delimiter=','))
+        self.files[name][1].writerow(row)
+
+    def close(self):
+        for dest_file, _ in self.files.values():
+            dest_file.close()
+        self.files.clear()
+
+
+# route the rows of one raw file into the bucket files (the shard of this raw file) under shard_path
+def split_raw_file(path, shard_path, number_of_files, max_open=64):
+    shard_path.mkdir(parents=True, exist_ok=True)
+    writers = BucketWriters(shard_path, max_open)
+    tx_counter = 0
+    print("processing file {}".format(path.name))
+    # the shards exported by query.py are compressed
+    if path.suffix == '.gz':
+        csvfile = gzip.open(path, 'rt', newline='')
+    else:
+        csvfile = open(path, newline='', buffering=1 << 20)
+    with csvfile:
+        spamreader = csv.reader(csvfile, delimiter=',')
+        next(spamreader, None)      # skip the header
+        for row in spamreader:
+            block_number = int(row[5])
+            if block_number >= 11000000 and block_number < 12000000:
+                tx_counter += 1
+                writers.writerow(bucket_name(block_number, number_of_files), row)
+    writers.close()
+    return tx_counter
 
 
 # split the raw data into files based on the block number of each transaction
-def preprocess_raw_data(root_path, number_of_files):
+def preprocess_raw_data(root_path, number_of_files, raw_file_count=None, workers=1):
     # the data we used is from block number 11,000,000 to 12,000,000
     # from Oct-06-2020 to Mar-08-2021
-    # containing in 167 separated files
-    if not (root_path / "processed").exists():
-        (root_path / "processed").mkdir(parents=True, exist_ok=True)
-    else:
+    # containing in 167 separated files (all the eth* files by default, either plain or .gz)
+    if (root_path / "processed").exists():
         print("Using existing processed files!")
+        build_columns(root_path, workers)
         return
 
-    tx_counter = 0
-    for i in range(167):
-        path = root_path / "eth{:012d}".format(i)
-        print("processing file {}".format(i))
-        with open(path, newline='') as csvfile:
-            spamreader = csv.reader(csvfile, delimiter=',')
-            is_header = True
-            for row in spamreader:
-                if is_header:
-                    is_header = False
-                    continue
-                block_number = int(row[5])
-                if block_number >= 11000000 and block_number < 12000000:
-                    tx_counter += 1
-                    slot = (block_number - 11000000) / 1000000 * number_of_files
-                    start_block = 11000000 + int(slot) * 1000000 / number_of_files
-                    end_block = start_block + 1000000 / number_of_files - 1
-                    dest_file_name = "block_{}_to_{}.csv".format(int(start_block), int(end_block))
-                    dest_file_path = root_path / "processed/{}".format(dest_file_name)
-                    with open(dest_file_path, "a", newline='') as dest_file:
-                        writter = csv.writer(dest_file, delimiter=',')
-                        writter.writerow(row)
+    # each raw file is split into its own shard of bucket files (in parallel), then the shards are
+    # merged in the order of the raw files, the result is moved to processed/ once it is complete
+    temp_path = root_path / "processed_tmp"
+    if temp_path.exists():
+        shutil.rmtree(temp_path)
+    if raw_file_count is None:
+        raw_file_count = len([f for f in root_path.glob("eth*") if f.name[3:].split('.')[0].isdigit()])
+    raw_paths = [root_path / "eth{:012d}".format(i) for i in range(raw_file_count)]
+    raw_paths = [p if p.exists() else p.with_name(p.name + '.gz') for p in raw_paths]
+    shard_paths = [temp_path / "shards" / str(i) for i in range(raw_file_count)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        tx_counter = sum(executor.map(split_raw_file, raw_paths, shard_paths, [number_of_files] * raw_file_count))
+
+    names = sorted({f.name for shard_path in shard_paths for f in shard_path.iterdir()})
+    for name in names:
+        with open(temp_path / name, "wb") as dest_file:
+            for shard_path in shard_paths:
+                if (shard_path / name).exists():
+                    with open(shard_path / name, "rb") as shard_file:
+                        shutil.copyfileobj(shard_file, dest_file, 1 << 24)
+    shutil.rmtree(temp_path / "shards")
+    temp_path.rename(root_path / "processed")
     print("Finish splitting {} transactions!".format(tx_counter))
+    build_columns(root_path, workers)
     return
 
 
@@ -58,59 +118,302 @@ def uniform_subset_split(subsets, address):
     return slot
 
 
-# generate the real dataset based on the yaml file
-def generate(raw_data_path, subsets, tx_count, seed):
-    np.random.seed(seed)
-    starting_ind = np.random.randint(11000000, 11900000) # in case there is not enough transactions (use 11900000)
-    # generate dataset containing all kinds of transactions and contract transactions only
+# the value of each hex digit (both cases), the other characters are 0
+HEX_TABLE = np.zeros(256, dtype=np.uint64)
+for i, c in enumerate('0123456789abcdef'):
+    HEX_TABLE[ord(c)] = HEX_TABLE[ord(c.upper())] = i
+PREFIX_DIGITS = 8
+
+
+# the first 8 hex digits (32 bits) of each address (0x...) as an integer array
+def address_prefix(addresses):
+    chars = np.asarray(addresses, dtype='S{}'.format(PREFIX_DIGITS + 2))
+    chars = np.ascontiguousarray(chars).view(np.uint8).reshape(len(chars), PREFIX_DIGITS + 2)
+    digits = HEX_TABLE[chars[:, 2:]]
+    shifts = np.arange(4 * (PREFIX_DIGITS - 1), -1, -4, dtype=np.uint64)
+    return np.bitwise_or.reduce(digits << shifts, axis=1).astype(np.int64)
+
+
+# the vectorized uniform_subset_split over an array of addresses (or their parsed prefixes): with 2^k
+# subsets the slot is the top k bits of the address, the other subset counts use the same integer
+# division over the first ceil(log16(subsets)) hex digits
+def uniform_subset_split_batch(subsets, addresses=None, prefix=None):
+    if prefix is None:
+        prefix = address_prefix(addresses)
+    k = subsets.bit_length() - 1
+    if subsets == 1 << k:
+        return prefix >> (4 * PREFIX_DIGITS - k)
+    ind = 1
+    while 16 ** ind < subsets and ind < PREFIX_DIGITS:
+        ind += 1
+    return ((prefix >> (4 * (PREFIX_DIGITS - ind))) * subsets) >> (4 * ind)
+
+
+# the slots of the addresses (or their parsed prefixes) for every subset count in subsets_list,
+# the addresses are parsed once
+def uniform_subset_split_multi(subsets_list, addresses=None, prefix=None):
+    if prefix is None:
+        prefix = address_prefix(addresses)
+    return {subsets: uniform_subset_split_batch(subsets, prefix=prefix) for subsets in subsets_list}
+
+
+# the sidecar index of the processed files: for the first row of every block, the block number, the file
+# (position in the list of processed files ordered by block) and the byte offset of the row in the file.
+# The rows of each processed file are sorted (stably) by block number before they are indexed.
+def build_block_index(raw_data_path):
+    processed_path = Path(raw_data_path) / 'processed'
+    names = sorted((f.name for f in processed_path.glob('block_*_to_*.csv')), key=lambda x: int(x.split('_')[1]))
+    blocks, files, offsets = [], [], []
+    for file_ind, name in enumerate(names):
+        path = processed_path / name
+        with open(path, 'rb') as f:
+            lines = f.readlines()
+        block_numbers = [int(line.rsplit(b',', 1)[1]) for line in lines]
+        if any(block_numbers[i] > block_numbers[i + 1] for i in range(len(block_numbers) - 1)):
+            order = sorted(range(len(lines)), key=lambda i: block_numbers[i])
+            lines, block_numbers = [lines[i] for i in order], [block_numbers[i] for i in order]
+            # the sorted file replaces the original one once it is complete
+            temp_path = path.with_name(path.name + '_tmp')
+            with open(temp_path, 'wb') as f:
+                f.writelines(lines)
+            temp_path.replace(path)
+
+        offset, last_block = 0, None
+        for line, block_number in zip(lines, block_numbers):
+            if block_number != last_block:
+                blocks.append(block_number)
+                files.append(file_ind)
+                offsets.append(offset)
+                last_block = block_number
+            offset += len(line)
+
+    temp_path = processed_path / 'block_index_tmp.npz'
+    np.savez(temp_path, blocks=np.array(blocks, dtype=np.int64),
+             files=np.array(files, dtype=np.int64), offsets=np.array(offsets, dtype=np.int64), names=np.array(names))
+    temp_path.replace(processed_path / 'block_index.npz')
+
+
+def load_block_index(raw_data_path):
+    index_path = Path(raw_data_path) / 'processed' / 'block_index.npz'
+    if not index_path.exists():
+        build_block_index(raw_data_path)
+    with np.load(index_path) as index:
+        return index['blocks'], index['files'], index['offsets'], index['names'].tolist()
+
+
+# iterate the processed rows from the first block >= starting_block, across the processed files
+def iter_processed_rows(raw_data_path, starting_block):
+    blocks, files, offsets, names = load_block_index(raw_data_path)
+    pos = int(np.searchsorted(blocks, starting_block))
+    if pos == len(blocks):
+        return
+    for file_ind in range(int(files[pos]), len(names)):
+        with open(Path(raw_data_path) / 'processed' / names[file_ind], 'r', newline='') as f:
+            if file_ind == files[pos]:
+                f.seek(int(offsets[pos]))
+            for line in csv.reader(f, delimiter=','):
+                yield line
+
+
+# the columnar copy of the processed files, one .npy file per column and bucket under processed/columns:
+# the digest of the tx hash (its first 16 hex digits), the prefixes of the from, to and state addresses
+# (see address_prefix), the flags of the non-empty to (bit 0) and state (bit 1) addresses, gas and block number
+COLUMNS = {'hash': np.uint64, 'from': np.uint32, 'to': np.uint32, 'state': np.uint32,
+           'flags': np.uint8, 'gas': np.uint32, 'block': np.uint32}
+
+
+def column_path(columns_path, name, column):
+    return columns_path / '{}.{}.npy'.format(name[:-len('.csv')], column)
+
+
+def write_columns(path, columns_path):
+    rows = {column: [] for column in ('hash', 'from', 'to', 'state', 'gas', 'block')}
+    with open(path, 'r', newline='') as f:
+        for line in csv.reader(f, delimiter=','):
+            for column, value in zip(rows, line):
+                rows[column].append(value)
+
+    data = dict()
+    data['hash'] = np.array([int(h[2:18], 16) for h in rows['hash']], dtype=np.uint64)
+    for column in ('from', 'to', 'state'):
+        data[column] = address_prefix(rows[column])
+    data['flags'] = (np.array([bool(a) for a in rows['to']], dtype=np.uint8)
+                     | (np.array([bool(a) for a in rows['state']], dtype=np.uint8) << 1))
+    data['gas'] = np.array(rows['gas'], dtype=np.int64)
+    data['block'] = np.array(rows['block'], dtype=np.int64)
+    for column, dtype in COLUMNS.items():
+        np.save(column_path(columns_path, path.name, column), data[column].astype(dtype))
+
+
+# write the columns of every processed file (sorted by block number first), in parallel
+def build_columns(raw_data_path, workers=1):
+    processed_path = Path(raw_data_path) / 'processed'
+    if (processed_path / 'columns').exists():
+        return
+    names = load_block_index(raw_data_path)[3]
+    temp_path = processed_path / 'columns_tmp'
+    if temp_path.exists():
+        shutil.rmtree(temp_path)
+    temp_path.mkdir()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(write_columns, [processed_path / name for name in names], [temp_path] * len(names)))
+    temp_path.rename(processed_path / 'columns')
+    print("Finish writing the columns of {} files!".format(len(names)))
+
+
+# iterate the columns (memory-mapped) of the processed files from the first block >= starting_block
+def iter_column_chunks(raw_data_path, starting_block):
+    columns_path = Path(raw_data_path) / 'processed' / 'columns'
+    for name in load_block_index(raw_data_path)[3]:
+        chunk = {column: np.load(column_path(columns_path, name, column), mmap_mode='r') for column in COLUMNS}
+        if len(chunk['block']) == 0 or chunk['block'][-1] < starting_block:
+            continue
+        start = int(np.searchsorted(chunk['block'], starting_block))
+        yield {column: np.asarray(array[start:]) for column, array in chunk.items()}
+
+
+# the columnar version of read_transactions, the address prefixes are returned instead of the addresses.
+# The log rows of a transaction are in the same block, hence in the same processed file
+def read_transactions_columns(raw_data_path, starting_block, tx_count):
+    chunks, all_count, contract_count = [], 0, 0
+    for chunk in iter_column_chunks(raw_data_path, starting_block):
+        first = np.zeros(len(chunk['hash']), dtype=bool)
+        first[np.unique(chunk['hash'], return_index=True)[1]] = True
+        contract = first & ((chunk['flags'] & 2) != 0)
+        reached = np.flatnonzero((all_count + np.cumsum(first) >= tx_count)
+                                 & (contract_count + np.cumsum(contract) >= tx_count))
+        if len(reached) > 0:
+            end = int(np.searchsorted(chunk['block'], chunk['block'][reached[0]], side='right'))
+            chunks.append({column: array[:end] for column, array in chunk.items()})
+            break
+        chunks.append(chunk)
+        all_count += int(first.sum())
+        contract_count += int(contract.sum())
+    if not chunks:
+        return [], np.zeros(0, dtype=np.int64), []
+    rows = {column: np.concatenate([chunk[column] for chunk in chunks]) for column in COLUMNS}
+
+    # the transactions are ordered by their first rows
+    _, first_rows, inverse = np.unique(rows['hash'], return_index=True, return_inverse=True)
+    order = np.argsort(first_rows, kind='stable')
+    position = np.empty(len(order), dtype=np.int64)
+    position[order] = np.arange(len(order))
+    first_rows = first_rows[order]
+    has_state = (rows['flags'] & 2) != 0
+    transactions = [[gas, block, 'contract' if state else 'transfer'] for gas, block, state in zip(
+        rows['gas'][first_rows].tolist(), rows['block'][first_rows].tolist(), has_state[first_rows].tolist())]
+
+    # the first row of a transaction adds the from address and the state (or to) address,
+    # the other rows add their state addresses
+    is_first = np.zeros(len(inverse), dtype=bool)
+    is_first[first_rows] = True
+    counts = np.where(is_first, 2, has_state.astype(np.int64))
+    owner_rows = np.repeat(np.arange(len(counts)), counts)
+    second = np.arange(len(owner_rows)) - np.repeat(np.cumsum(counts) - counts, counts) == 1
+    prefix = np.where(is_first[owner_rows] & ~second, rows['from'][owner_rows],
+                      np.where(has_state[owner_rows], rows['state'][owner_rows], rows['to'][owner_rows]))
+    return transactions, prefix.astype(np.int64), position[inverse[owner_rows]].tolist()
+
+
+# read the transactions from the starting block until both kinds of transactions are at least tx_count,
+# the rows of the last block are all read since the log rows of a transaction share its block.
+# Return the [size, block number, type] of each transaction (in block order) and the prefixes of the
+# addresses to map into subsets, together with the position of the transaction owning each address.
+# The columns are used when they exist, otherwise the processed csv files are parsed
+def read_transactions(raw_data_path, starting_block, tx_count):
+    if (Path(raw_data_path) / 'processed' / 'columns').exists():
+        return read_transactions_columns(raw_data_path, starting_block, tx_count)
+    tx_map = dict()  # t_hash : position of the transaction
+    transactions, addresses, owners = [], [], []
+    all_count, contract_count, stop_block = 0, 0, None
+    for line in iter_processed_rows(raw_data_path, starting_block):
+        # line is in the format (tx_hash, from_address, to_address, state_address, gas, block_number)
+        if stop_block is not None and int(line[5]) > stop_block:
+            break
+        t_hash = line[0]
+        if t_hash in tx_map:
+            # one more log of a contract transaction
+            if line[3]:
+                addresses.append(line[3])
+                owners.append(tx_map[t_hash])
+            continue
+        tx_map[t_hash] = len(transactions)
+        if line[3]:
+            # contract transaction
+            transactions.append([int(line[4]), int(line[5]), 'contract'])
+            addresses.extend((line[1], line[3]))
+            contract_count += 1
+        else:
+            # token transfer transaction
+            transactions.append([int(line[4]), int(line[5]), 'transfer'])
+            addresses.extend((line[1], line[2]))
+        owners.extend((tx_map[t_hash], tx_map[t_hash]))
+        all_count += 1
+        if stop_block is None and all_count >= tx_count and contract_count >= tx_count:
+            stop_block = int(line[5])
+    return transactions, address_prefix(addresses), owners
+
+
+# the covered subsets of each transaction, the slots are added in the order of the rows
+def collect_covers(slots, owners, count):
+    covers = [set() for _ in range(count)]
+    for owner, slot in zip(owners, slots.tolist()):
+        covers[owner].add(slot)
+    return covers
+
+
+# format the first tx_count transactions (all kinds, real_type 0) and the first tx_count contract
+# transactions (real_type 1) into lines, return None if there are not enough contract transactions
+def format_real_txs(transactions, covers, tx_count):
     all_txs, contract_txs = [], []
     all_txs_counter, contract_txs_counter = 0, 0
-    b = int(starting_ind / 20000) * 20000
-    file_path = Path(raw_data_path) / 'processed' / 'block_{}_to_{}.csv'.format(b, b + 19999)
-
-    cover_map = dict()  # t_hash : [covered subsets, size]
-    # generate dataset containing all kinds of transactions
-    with open(file_path, 'r') as f:
-        lines = csv.reader(f, delimiter = ',')
-        for line in lines:
-            # line is in the format (tx_hash, from_address, to_address, state_address, gas, block_number)
-            if int(line[5]) >= starting_ind:
-                if line[3]:
-                    # contract transaction
-                    t_hash = line[0]
-                    if t_hash != cover_map:
-                        cover_map[t_hash] = [{uniform_subset_split(subsets, line[1]), uniform_subset_split(subsets, line[3])},
-                            int(line[4]), int(line[5]), 'contract']
-                    else:
-                        cover_map[t_hash][0] |= uniform_subset_split(subsets, line[3])
-                else:
-                    # token transfer transaction
-                    t_hash = line[0]
-                    if t_hash != cover_map:
-                        cover_map[t_hash] = [{uniform_subset_split(subsets, line[1]), uniform_subset_split(subsets, line[2])},
-                            int(line[4]), int(line[5]), 'transfer']
-
-    transactions = []
-    for _, v in cover_map.items():
-        transactions.append(v)
-    transactions = sorted(transactions, key=lambda x:x[2])
-
-    for tx in transactions:
+    for tx, cover in zip(transactions, covers):
         if all_txs_counter < tx_count:
-            temp = ','.join([str(i) for i in list(tx[0])])
-            all_txs.append(str(all_txs_counter) + ';' + temp + ';' + str(tx[1]) + '\n')
+            temp = ','.join([str(i) for i in list(cover)])
+            all_txs.append(str(all_txs_counter) + ';' + temp + ';' + str(tx[0]) + '\n')
             all_txs_counter += 1
         if tx[-1] == 'contract':
             if contract_txs_counter < tx_count:
-                temp = ','.join([str(i) for i in list(tx[0])])
-                contract_txs.append(str(contract_txs_counter) + ';' + temp + ';' + str(tx[1]) + '\n')
+                temp = ','.join([str(i) for i in list(cover)])
+                contract_txs.append(str(contract_txs_counter) + ';' + temp + ';' + str(tx[0]) + '\n')
                 contract_txs_counter += 1
+            elif all_txs_counter >= tx_count:
+                break
 
     if len(contract_txs) < tx_count:
-        raise EOFError
+        return None
+    return all_txs, contract_txs
+
 
-    save_data(all_txs, parse_path(tx_count, subsets, seed, real_type=0))
-    save_data(contract_txs, parse_path(tx_count, subsets, seed, real_type=1))
+# generate the real datasets of one seed for every (subsets, tx_count) in variants in one pass: the rows
+# are read once up to the largest tx_count (a smaller dataset is a prefix of a larger one) and the
+# addresses are parsed once for all the subset counts
+def generate_all(raw_data_path, variants, seed):
+    np.random.seed(seed)
+    # the range of the starting block is kept so that each seed keeps its starting block
+    starting_ind = np.random.randint(11000000, 11900000)
+    variants = sorted(set(variants))
+    transactions, prefix, owners = read_transactions(raw_data_path, starting_ind, max(t for _, t in variants))
+    slots = uniform_subset_split_multi(sorted(set(s for s, _ in variants)), prefix=prefix)
+
+    missing = []
+    for subsets in slots:
+        covers = collect_covers(slots[subsets], owners, len(transactions))
+        for tx_count in [t for s, t in variants if s == subsets]:
+            txs = format_real_txs(transactions, covers, tx_count)
+            if txs is None:
+                missing.append((subsets, tx_count))
+                continue
+            for real_type in (0, 1):
+                save_data(txs[real_type], parse_path(tx_count, subsets, seed, real_type=real_type))
+
+    if missing:
+        raise EOFError('not enough contract transactions for (subsets, tx_count) {} with seed {}'.format(missing, seed))
+
+
+# generate the real dataset based on the yaml file
+def generate(raw_data_path, subsets, tx_count, seed):
+    generate_all(raw_data_path, [(subsets, tx_count)], seed)
 
 
 if __name__ == '__main__':
@@ -123,6 +426,8 @@ if __name__ == '__main__':
                         help='number of system state subsets')
     parser.add_argument('--seed', type=int, default=2602,
                         help='set random seed')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes to generate the files')
     opt = parser.parse_args()
 
     if opt.cfg and Path(opt.cfg).exists():
@@ -134,13 +439,15 @@ if __name__ == '__main__':
         default_subset, subsets_list = cfg['default_subset'], cfg['subsets_list']
 
         raw_data_path = Path(cfg['raw_data_path'])
-        preprocess_raw_data(root_path = raw_data_path, number_of_files=50)
+        preprocess_raw_data(root_path = raw_data_path, number_of_files=50, workers=opt.workers)
 
+        # the starting block of a real dataset only depends on its seed, so no child streams are needed,
+        # all the datasets of a seed are extracted by one task
+        tasks = []
         for seed in seed_list:
-            # vary number of candidate transactions
-            for txn in txn_list:
-               generate(raw_data_path, subsets=default_subset, tx_count=txn, seed=seed)
-            # vary number of covered subsets
-            for subsets in subsets_list:
-                print("generating the file with {} subsets, {} txs and seed {}".format(subsets, default_txn, seed))
-                generate(raw_data_path, subsets=subsets, tx_count=default_txn, seed=seed)
+            # vary number of candidate transactions, and then vary number of covered subsets
+            variants = [(default_subset, txn) for txn in txn_list] + [(subsets, default_txn) for subsets in subsets_list]
+            print("generating the files with (subsets, txs) {} and seed {}".format(variants, seed))
+            tasks.append((generate_all, dict(raw_data_path=raw_data_path, variants=variants, seed=seed),
+                          [parse_path(txn, subsets, seed, real_type=t) for (subsets, txn) in variants for t in (0, 1)]))
+        run_tasks(tasks, workers=opt.workers)
@@ -4,108 +4,174 @@
 # This file implements the synthetic data generation
 
 import numpy as np
-import scipy.stats as stats
 import argparse
+import time
 import yaml
 from pathlib import Path
-from utils import save_data, parse_path
+from utils import save_data, parse_path, run_tasks, task_seed
 
-def generate(subsets, tx_count, set_distribution, size_distribution, seed):
-    np.random.seed(seed)
-    txs = []        # list of transactions tuples: (id, [covered subsets], size)
-    covered_subset_count = np.ones(tx_count)    # the covered subset count of each transaction
-    tx_size = np.ones(tx_count)         # the size of each transaction
+# sample the size of each transaction, we assume the minimum unit of size is 1
+def sample_sizes(rng, size_distribution, subsets, tx_count):
+    size_dist, size_mu, size_std = size_distribution[0], float(size_distribution[1][0]), float(size_distribution[1][1])
 
+    if size_dist == 'normal':
+        tx_size = rng.normal(size_mu, size_std, tx_count)
+    elif size_dist == 'uniform':
+        size_low, size_high = size_mu - np.sqrt(3) * size_std , size_mu + np.sqrt(3) * size_std
+        tx_size = rng.uniform(size_low, size_high, tx_count)
+    elif size_dist == 'power_law':
+        tx_size = subsets * rng.power(size_mu, tx_count)
+    else:
+        raise NotImplementedError
+
+    tx_size[tx_size < 1] = 1
+    return np.round(tx_size).astype(np.int64)
+
+
+# sample the covered subset count of each transaction
+def sample_set_counts(rng, set_distribution, subsets, tx_count):
     set_dist, set_mu, set_std = set_distribution[0], float(set_distribution[1][0]), float(set_distribution[1][1])
-    size_dist, size_mu, size_std = size_distribution[0], float(size_distribution[1][0]), float(size_distribution[1][1])
 
     if set_dist == 'normal':
-        covered_subset_count = np.random.normal(set_mu, set_std, tx_count)
-        covered_subset_count[covered_subset_count < 1] = 1  # we do not consider a TX involving no subset
-        covered_subset_count[covered_subset_count > subsets] = subsets  # the covered subsets cannot exceed the number of all subsets
-        covered_subset_count = [int(round(numb)) for numb in covered_subset_count]
+        covered_subset_count = np.round(rng.normal(set_mu, set_std, tx_count))
     elif set_dist == 'uniform':
         # for uniform distribution, (a+b)/2 = mu, (b-a)^2/12 = std^2
         set_low, set_high = set_mu - np.sqrt(3) * set_std , set_mu + np.sqrt(3) * set_std
-        covered_subset_count = np.random.randint(set_low, set_high, tx_count)
+        covered_subset_count = rng.integers(int(set_low), int(set_high), tx_count)
     elif set_dist == 'power_law':
         # here we only use the first parameter as the a of the power law distribution
-        a = set_mu
-        covered_subset_count = subsets * np.random.power(a, tx_count)
-        covered_subset_count = [int(round(numb)) for numb in covered_subset_count]
+        covered_subset_count = np.round(subsets * rng.power(set_mu, tx_count))
     else:
         raise NotImplementedError
 
-    if size_dist == 'normal':
-        tx_size = np.random.normal(size_mu, size_std, tx_count)
-    elif size_dist == 'uniform':
-        size_low, size_high = size_mu - np.sqrt(3) * size_std , size_mu + np.sqrt(3) * size_std
-        tx_size = np.random.uniform(size_low, size_high, tx_count)
-    elif size_dist == 'power_law':
-        a = size_mu
-        tx_size = subsets * np.random.power(a, tx_count)
-    else:
-        raise NotImplementedError
+    # we do not consider a TX involving no subset, and the covered subsets cannot exceed the number of all subsets
+    return np.clip(covered_subset_count, 1, subsets).astype(np.int64)
+
+
+# draw the covered subsets (without replacement) of a chunk of transactions at once by running
+# Floyd's sampling algorithm on all rows together: at step t, a row with k covered subsets draws
+# r from [0, j] with j = subsets - k + t and keeps r if it is new, otherwise it keeps j
+def sample_covers(rng, subsets, counts):
+    width = int(counts.max()) if len(counts) > 0 else 0
+    chosen = np.zeros((len(counts), width), dtype=np.int64)
+    for t in range(width):
+        j = subsets - counts + t
+        r = rng.integers(0, j + 1)
+        duplicated = (chosen[:, :t] == r[:, None]).any(axis=1)
+        chosen[:, t] = np.where(duplicated, j, r)
+
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets, chosen[np.arange(width) < counts[:, None]]
+
 
-    tx_size[tx_size < 1] = 1  # we assume the minimum unit of size is 1
-    tx_size = [int(round(numb)) for numb in tx_size]
+def generate(subsets, tx_count, set_distribution, size_distribution, seed, rng=None, chunk_size=65536):
+    # the randomness comes from an explicit generator (or a SeedSequence), by default seeded by the seed and
+    # the parameters of the file (the stream run_tasks gives to this task)
+    if rng is None:
+        rng = task_seed(seed, dict(subsets=subsets, tx_count=tx_count, set_distribution=set_distribution,
+                                   size_distribution=size_distribution))
+    rng = np.random.default_rng(rng)
 
-    # the item format is (id, [covered subsets], size)
-    for index in range(tx_count):
-        temp = np.random.choice(subsets, covered_subset_count[index], replace=False).tolist()
-        temp = ','.join([str(i) for i in temp])
-        txs.append(str(index) + ';' + temp + ';' + str(tx_size[index]) + '\n')
+    covered_subset_count = sample_set_counts(rng, set_distribution, subsets, tx_count)
+    tx_size = sample_sizes(rng, size_distribution, subsets, tx_count)
+
+    # the item format is (id, [covered subsets], size), stored as the CSR arrays
+    offsets, covers = [np.zeros(1, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    for start in range(0, tx_count, chunk_size):
+        chunk_offsets, chunk_covers = sample_covers(rng, subsets, covered_subset_count[start:start + chunk_size])
+        offsets.append(chunk_offsets[1:] + offsets[-1][-1])
+        covers.append(chunk_covers)
+    txs = (np.arange(tx_count, dtype=np.int64), np.concatenate(offsets), np.concatenate(covers), tx_size)
 
     save_data(txs, parse_path(tx_count, subsets, seed, set_distribution, size_distribution))
 
 
+# the pmf vector of the bounded zipfian distribution over ranks 1..N (entry i-1 is the pmf of rank i)
 def zipfian(a, N):
     x = np.arange(1, N + 1)
     weights = x ** (-a)
-    weights = weights.astype(np.float)
+    weights = weights.astype(float)
     weights /= weights.sum()
-    bounded_zipf = stats.rv_discrete(name='bounded_zipf', values=(x, weights))
-    return bounded_zipf
+    return weights
 
 
-def generate_for_simulation(a, subsets, tx_count, size_distribution, seed):
-    np.random.seed(seed)
-    txs = []  # list of transactions tuples: (id, [covered subsets], size)
-    tx_size = np.ones(tx_count)  # the size of each transaction
+# each subset i is covered independently with probability pmf[i], a row covering no subset
+# is drawn again (only the empty rows are redrawn, block by block)
+def sample_zipf_covers(rng, pmf, tx_count):
+    inclusion = rng.random((tx_count, len(pmf))) < pmf
+    empty = np.flatnonzero(~inclusion.any(axis=1))
+    while len(empty) > 0:
+        inclusion[empty] = rng.random((len(empty), len(pmf))) < pmf
+        empty = empty[~inclusion[empty].any(axis=1)]
 
-    size_dist, size_mu, size_std = size_distribution[0], float(size_distribution[1][0]), float(size_distribution[1][1])
+    offsets = np.zeros(tx_count + 1, dtype=np.int64)
+    np.cumsum(inclusion.sum(axis=1), out=offsets[1:])
+    return offsets, np.nonzero(inclusion)[1]
 
-    if size_dist == 'normal':
-        tx_size = np.random.normal(size_mu, size_std, tx_count)
-    elif size_dist == 'uniform':
-        size_low, size_high = size_mu - np.sqrt(3) * size_std , size_mu + np.sqrt(3) * size_std
-        tx_size = np.random.uniform(size_low, size_high, tx_count)
-    elif size_dist == 'power_law':
-        a = size_mu
-        tx_size = subsets * np.random.power(a, tx_count)
-    else:
-        raise NotImplementedError
 
-    tx_size[tx_size < 1] = 1  # we assume the minimum unit of size is 1
-    tx_size = [int(round(numb)) for numb in tx_size]
+def generate_for_simulation(a, subsets, tx_count, size_distribution, seed, rng=None, chunk_size=None):
+    if rng is None:
+        rng = task_seed(seed, dict(a=a, subsets=subsets, tx_count=tx_count, size_distribution=size_distribution))
+    rng = np.random.default_rng(rng)
+    if chunk_size is None:
+        chunk_size = max(1, (1 << 22) // subsets)     # bound the inclusion matrix to 4M entries
 
-    zipf = zipfian(a, subsets)
+    tx_size = sample_sizes(rng, size_distribution, subsets, tx_count)
+    pmf = zipfian(a, subsets)
+    print("the minimum prob is : {}".format(pmf[-1]))
 
-    # the item format is (id, [covered subsets], size)
-    for index in range(tx_count):
-        print("generating the {}-th transaction.".format(index))
-        print("the minimum prob is : {}".format(zipf.pmf(subsets)))
-        covers = []
-        while len(covers) == 0:
-            for i in range(1, subsets + 1):
-                if np.random.random() < zipf.pmf(i):
-                    covers.append(i - 1)
-        covers = ','.join([str(i) for i in covers])
-        txs.append(str(index) + ';' + covers + ';' + str(tx_size[index]) + '\n')
+    # the item format is (id, [covered subsets], size), stored as the CSR arrays
+    offsets, covers = [np.zeros(1, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    for start in range(0, tx_count, chunk_size):
+        chunk_offsets, chunk_covers = sample_zipf_covers(rng, pmf, min(chunk_size, tx_count - start))
+        offsets.append(chunk_offsets[1:] + offsets[-1][-1])
+        covers.append(chunk_covers)
+    txs = (np.arange(tx_count, dtype=np.int64), np.concatenate(offsets), np.concatenate(covers), tx_size)
 
     save_data(txs, parse_path(tx_count, subsets, seed, size_distribution = size_distribution, zipfian=a))
 
 
+# an unbounded stream of transactions for online packing experiments, yielding (arrival time, (id, [covered subsets], size)).
+# The covered subsets follow the set distribution, or the bounded zipfian distribution with coefficient zipf when it
+# is given, and the sizes follow the size distribution (the same models as the generated files).
+# The arrival process is 'poisson' (exponential inter-arrival times with mean 1/rate) or 'constant' (one transaction
+# every 1/rate). The stream stops after tx_count transactions if it is set, and with realtime the transactions are
+# yielded no faster than their arrival times (in seconds) on the wall clock.
+def stream_transactions(subsets, size_distribution, set_distribution=None, zipf=None, rate=1.0, arrival='poisson',
+                        seed=None, rng=None, tx_count=None, block=4096, realtime=False):
+    rng = np.random.default_rng(seed if rng is None else rng)
+    if zipf is not None:
+        pmf = zipfian(zipf, subsets)
+    elif set_distribution is None:
+        raise ValueError('either the set distribution or the zipfian coefficient should be given')
+
+    index, timer, start = 0, 0.0, time.time()
+    while tx_count is None or index < tx_count:
+        count = block if tx_count is None else min(block, tx_count - index)
+        if zipf is not None:
+            offsets, covers = sample_zipf_covers(rng, pmf, count)
+        else:
+            offsets, covers = sample_covers(rng, subsets, sample_set_counts(rng, set_distribution, subsets, count))
+        sizes = sample_sizes(rng, size_distribution, subsets, count).tolist()
+
+        if arrival == 'poisson':
+            intervals = rng.exponential(1 / rate, count)
+        elif arrival == 'constant':
+            intervals = np.full(count, 1 / rate)
+        else:
+            raise ValueError("unknown arrival process '{}', expected 'poisson' or 'constant'".format(arrival))
+        timestamps = (timer + np.cumsum(intervals)).tolist()
+        timer = timestamps[-1]
+
+        offsets, covers = offsets.tolist(), covers.tolist()
+        for i in range(count):
+            if realtime:
+                time.sleep(max(0.0, start + timestamps[i] - time.time()))
+            yield timestamps[i], (index + i, covers[offsets[i]:offsets[i + 1]], sizes[i])
+        index += count
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--cfg', type=str, default='../cfgs/synthetic.yaml',
@@ -124,6 +190,8 @@ if __name__ == '__main__':
                         help='parameters of the distribution of the number of covered subsets (e.g., mu, sigma for normal distribution)')
     parser.add_argument('--size-parameters', type=str, default="10,1",
                         help='parameters of the distribution of the size of transactions (e.g., mu, sigma for normal distribution)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes to generate the files')
     opt = parser.parse_args()
 
     if opt.cfg and Path(opt.cfg).exists():
@@ -140,38 +208,36 @@ if __name__ == '__main__':
 
             for seed in seed_list:
                 print(seed)
+                tasks = []
+
+                def add_task(subsets, tx_count, set_distribution, size_distribution):
+                    kwargs = dict(subsets=subsets, tx_count=tx_count, set_distribution=set_distribution,
+                                  size_distribution=size_distribution, seed=seed)
+                    tasks.append((generate, kwargs,
+                                  [parse_path(tx_count, subsets, seed, set_distribution, size_distribution)]))
+
                 # vary number of candidate transactions
                 for txn in txn_list:
-                    generate(subsets=default_subset, tx_count=txn,
-                             set_distribution=default_set_dist,
-                             size_distribution=default_size_dist,
-                             seed=seed)
+                    add_task(default_subset, txn, default_set_dist, default_size_dist)
                 # vary number of covered subsets
                 for subsets in subsets_list:
-                    generate(subsets=subsets, tx_count=default_txn,
-                             set_distribution=default_set_dist,
-                             size_distribution=default_size_dist,
-                             seed=seed)
+                    add_task(subsets, default_txn, default_set_dist, default_size_dist)
                 # vary set distribution (mu and std)
                 for set_dist in set_dist_list:
                     for mu in set_dist_mu_list:
-                        generate(subsets=default_subset, tx_count=default_txn,
-                                    set_distribution=[set_dist, [str(mu), str(round(mu * 0.2, 1))]],
-                                    size_distribution=default_size_dist,
-                                    seed=seed)
+                        add_task(default_subset, default_txn, [set_dist, [str(mu), str(round(mu * 0.2, 1))]],
+                                 default_size_dist)
                 for set_dist in set_dist_list:
                     for std_p in dist_std_proportion_list:
-                        generate(subsets=default_subset, tx_count=default_txn,
-                                 set_distribution=[set_dist, ['4', str(round(4 * std_p, 1))]],
-                                 size_distribution=default_size_dist,
-                                 seed=seed)
+                        add_task(default_subset, default_txn, [set_dist, ['4', str(round(4 * std_p, 1))]],
+                                 default_size_dist)
                 # vary size distribution (std only)
                 for size_dist in size_dist_list:
                     for std_p in dist_std_proportion_list:
-                        generate(subsets=default_subset, tx_count=default_txn,
-                                 set_distribution=default_set_dist,
-                                 size_distribution=[size_dist, ['100', str(int(100 * std_p))]],
-                                 seed=seed)
+                        add_task(default_subset, default_txn, default_set_dist,
+                                 [size_dist, ['100', str(int(100 * std_p))]])
+
+                run_tasks(tasks, workers=opt.workers, seed=seed)
         else:
             # generate the data for system simulation with different transaction correlation
             with open(Path(opt.cfg)) as f:
@@ -183,8 +249,12 @@ if __name__ == '__main__':
             size_dist = cfg['size_dist']
             seed_list = cfg['seed_list']
 
-            for subsets in subsets_list:
-                for a in zipfian_list:
-                    for seed in seed_list:
+            for seed in seed_list:
+                tasks = []
+                for subsets in subsets_list:
+                    for a in zipfian_list:
                         print('generating the file a={}, subsets={}, seed={}'.format(a, subsets, seed))
-                        generate_for_simulation(a, subsets, tx_count, size_dist, seed)
+                        kwargs = dict(a=a, subsets=subsets, tx_count=tx_count, size_distribution=size_dist, seed=seed)
+                        tasks.append((generate_for_simulation, kwargs,
+                                      [parse_path(tx_count, subsets, seed, size_distribution=size_dist, zipfian=a)]))
+                run_tasks(tasks, workers=opt.workers, seed=seed)
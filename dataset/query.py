@@ -3,21 +3,32 @@
 # Author:
 # This file implements the SQLs to query the raw Ethereum data from the Google Bigquery API.
 # Make sure to config your own GOOGLE_APPLICATION_CREDENTIALS environment!
+# The result is exported page by page into compressed shards (eth000000000000.gz, ...) with a checkpoint,
+# so an interrupted export resumes after the last exported row. A local csv file or SQLite database can
+# be used as the source instead of the BigQuery API.
 
 
-from google.cloud import bigquery
 import csv
+import io
+import os
+import gzip
+import json
+import sqlite3
+import argparse
+from itertools import islice
+from pathlib import Path
 
-client = bigquery.Client()
+# the columns of the raw data, preprocess_raw_data in generate_real_data.py reads them in this order
+HEADER = ['hash', 'from_address', 'to_address', 'address', 'gas', 'block_number']
 
 # the number of effected states = the number of distinct (filtered after the query) log originated addresses + one sender's address
 
 # from the joined TX and log table to select first n contract transactions
 subquery_from_contract_TXs = """
-    SELECT 
+    SELECT
         DISTINCT T.hash, T.from_address, T.gas, T.block_number
     FROM
-        `bigquery-public-data.crypto_ethereum.transactions` T 
+        `bigquery-public-data.crypto_ethereum.transactions` T
         INNER JOIN
         `bigquery-public-data.crypto_ethereum.logs` L
         ON
@@ -30,7 +41,7 @@ subquery_from_contract_TXs = """
 
 # from the TX table to select first n transactions. (to_address of the contract create TX is null)
 subquery_from_all_TXs = """
-    SELECT 
+    SELECT
         DISTINCT T.hash, T.from_address, T.to_address, T.gas, T.block_number
     FROM
         `bigquery-public-data.crypto_ethereum.transactions` T
@@ -53,29 +64,162 @@ subquery_from_all_TXs = """
 
 query = f"""
     SELECT
-        T.hash, T.from_address, T.to_address, L.address, T.gas
+        T.hash, T.from_address, T.to_address, L.address, T.gas, T.block_number
     FROM
         ({subquery_from_all_TXs}) T
         LEFT JOIN
         `bigquery-public-data.crypto_ethereum.logs` L
         ON
         T.hash=L.transaction_hash
+    ORDER BY
+        T.block_number, T.hash, L.log_index
 """
 
-query_job = client.query(query)
+# the local stand-in of the query: a table raw_data with the columns of HEADER
+sqlite_query = """
+    SELECT
+        hash, from_address, to_address, address, gas, block_number
+    FROM
+        raw_data
+    ORDER BY
+        rowid
+"""
+
+
+# the sources yield the pages (lists of rows) of the result from the row start_row on, the pages may be
+# shorter than page_size. The checkpoint (see export) keeps what a source needs to resume on the same result
+
+def bigquery_pages(page_size, start_row=0, checkpoint=None):
+    from google.cloud import bigquery
+
+    client = bigquery.Client()
+    if checkpoint is not None and checkpoint.get('table'):
+        # resume on the destination table of the first run (the row order of a new query job may differ)
+        table = client.get_table(checkpoint['table'])
+    else:
+        query_job = client.query(query)
+        query_job.result()
+        table = query_job.destination
+        if checkpoint is not None:
+            checkpoint['table'] = '{}.{}.{}'.format(table.project, table.dataset_id, table.table_id)
+    # the result is read from the destination table, page by page from the given row
+    rows = client.list_rows(table, start_index=start_row, page_size=page_size)
+    for page in rows.pages:
+        yield [['' if v is None else v for v in row.values()] for row in page]
+
+
+def csv_pages(path, page_size, start_row=0, checkpoint=None):
+    opener = gzip.open if Path(path).suffix == '.gz' else open
+    with opener(path, 'rt', newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)      # skip the header
+        for _ in islice(reader, start_row):
+            pass
+        while True:
+            page = list(islice(reader, page_size))
+            if not page:
+                break
+            yield page
+
+
+def sqlite_pages(path, page_size, start_row=0, checkpoint=None):
+    connection = sqlite3.connect(str(path))
+    try:
+        cursor = connection.execute('SELECT * FROM ({}) LIMIT -1 OFFSET ?'.format(sqlite_query), (start_row,))
+        while True:
+            page = cursor.fetchmany(page_size)
+            if not page:
+                break
+            yield [['' if v is None else v for v in row] for row in page]
+    finally:
+        connection.close()
+
+
+def shard_path(output_path, shard):
+    return Path(output_path) / 'eth{:012d}.gz'.format(shard)
+
+
+def load_checkpoint(output_path):
+    checkpoint_path = Path(output_path) / 'checkpoint.json'
+    if checkpoint_path.exists():
+        with open(checkpoint_path) as f:
+            return json.load(f)
+    return {'page': 0, 'rows': 0, 'table': None, 'shard': 0, 'shard_pages': 0, 'shard_bytes': 0, 'done': False}
+
+
+def save_checkpoint(output_path, checkpoint):
+    checkpoint_path = Path(output_path) / 'checkpoint.json'
+    temp_path = checkpoint_path.with_suffix('.tmp')
+    with open(temp_path, 'w') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, checkpoint_path)
+
+
+# stream the pages of the source into the shards under output_path, each shard holds pages_per_shard pages.
+# Each page is appended to its shard as one gzip member and the checkpoint (with the number of exported rows)
+# is written after the page is on disk, a restart drops the bytes written after the last checkpoint and asks
+# the source for the rows after the exported ones
+def export(source, output_path, page_size=100000, pages_per_shard=10):
+    output_path = Path(output_path)
+    output_path.mkdir(parents=True, exist_ok=True)
+    checkpoint = load_checkpoint(output_path)
+    if checkpoint['done']:
+        print("The export is complete!")
+        return checkpoint
+    if checkpoint['rows'] > 0:
+        print("resuming the export from row {} (page {})".format(checkpoint['rows'], checkpoint['page']))
+    path = shard_path(output_path, checkpoint['shard'])
+    if path.exists():
+        with open(path, 'r+b') as f:
+            f.truncate(checkpoint['shard_bytes'])
+
+    for page in source(page_size, checkpoint['rows'], checkpoint):
+        if checkpoint['shard_pages'] == pages_per_shard:
+            checkpoint.update(shard=checkpoint['shard'] + 1, shard_pages=0, shard_bytes=0)
+            path = shard_path(output_path, checkpoint['shard'])
+        text = io.StringIO()
+        csv_writer = csv.writer(text)
+        if checkpoint['shard_pages'] == 0:
+            csv_writer.writerow(HEADER)
+        csv_writer.writerows(page)
+        with open(path, 'ab') as f:
+            f.truncate(checkpoint['shard_bytes'])
+            f.write(gzip.compress(text.getvalue().encode('utf-8')))
+            f.flush()
+            os.fsync(f.fileno())
+            checkpoint['shard_bytes'] = f.tell()
+        checkpoint.update(page=checkpoint['page'] + 1, rows=checkpoint['rows'] + len(page),
+                          shard_pages=checkpoint['shard_pages'] + 1)
+        save_checkpoint(output_path, checkpoint)
+        print("exported page {} into {}".format(checkpoint['page'] - 1, path.name))
 
-iterator = query_job.result()
-rows = list(iterator)
+    checkpoint['done'] = True
+    save_checkpoint(output_path, checkpoint)
+    print("Finish exporting {} rows ({} pages) into {} shards!".format(checkpoint['rows'], checkpoint['page'],
+                                                                    checkpoint['shard'] + 1))
+    return checkpoint
 
-# if save_raw_data
-f = open('real/raw/raw_data.csv', 'w', encoding='utf-8', newline='')
-csv_writer = csv.writer(f)
-for row in rows:
-    csv_writer.writerow(row)
-f.close()
 
-# Transform the rows into a csv file
-# transactions = pd.DataFrame(data=[list(x.values()) for x in rows], columns=list(rows[0].keys()))
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source', type=str, default='bigquery', choices=['bigquery', 'csv', 'sqlite'],
+                        help='where the rows come from: the BigQuery API, a local csv file or a SQLite database')
+    parser.add_argument('--input', type=str, default=None,
+                        help='the csv file (with header, may be .gz) or the SQLite database of the local source')
+    parser.add_argument('--output', type=str, default='real/raw',
+                        help='the folder of the exported shards')
+    parser.add_argument('--page_size', type=int, default=100000,
+                        help='number of rows per page')
+    parser.add_argument('--pages_per_shard', type=int, default=10,
+                        help='number of pages per shard')
+    opt = parser.parse_args()
 
-# Look at the first 10 headlines
-# transactions.head(10)
+    if opt.source == 'bigquery':
+        source = bigquery_pages
+    elif opt.source == 'csv':
+        source = lambda page_size, start_row, checkpoint: csv_pages(opt.input, page_size, start_row, checkpoint)
+    else:
+        source = lambda page_size, start_row, checkpoint: sqlite_pages(opt.input, page_size, start_row, checkpoint)
+    export(source, opt.output, opt.page_size, opt.pages_per_shard)
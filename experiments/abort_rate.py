@@ -4,7 +4,7 @@
 import argparse
 import yaml
 from pathlib import Path
-from utils import read_data, parse_path
+from utils import load_data
 from simulation import split_batches
 import random
 
@@ -103,9 +103,9 @@ if __name__ == '__main__':
             for zipf in zipfian_list:
                 for seed in seed_list:
                     if exp_type == 'real_data':
-                        transactions = read_data(parse_path(tx_count, subsets, seed))
+                        transactions = load_data(tx_count, subsets, seed)
                     else:
-                        transactions = read_data(parse_path(tx_count, subsets, seed, size_distribution = size_dist, zipfian=zipf))
+                        transactions = load_data(tx_count, subsets, seed, size_distribution = size_dist, zipfian=zipf)
 
                     batches = split_batches(transactions, subsets, exp_block_count)
 
@@ -3,7 +3,9 @@
 # Author:
 # This file implements the best effort algorithm as our baseline
 
-from utils import read_data, parse_path
+from utils import load_data
+from transaction_set import as_transaction_set, popcount
+from knapsack import run_fill_selections, approx_fill_selection
 import time
 import numpy as np
 import argparse
@@ -11,66 +13,41 @@ import yaml
 from pathlib import Path
 
 
-def find_selected_txs(capacity, transactions, temp_table):
-    selected = []
-    for i in range(len(transactions) - 1, 0, -1):
-        if temp_table[(i, capacity)] > temp_table[(i-1, capacity)]:
-            selected.append(i)
-            capacity -= transactions[i][2]
-    return selected
+def best_effort(transactions, subsets, capacity, eps=0):
+    return best_effort_multi(transactions, subsets, [capacity], eps)[0]
 
 
-def DP_fill_core(table, ind, tx_size, c):
-    if c-tx_size < 0:
-        return table[(ind-1, c)]
+# the best effort results (objective, selected transactions) for every capacity of a sweep
+def best_effort_multi(transactions, subsets, capacities, eps=0):
+    return [result[:2] for result in best_effort_fills(transactions, subsets, capacities, eps)]
 
-    if table[(ind-1, c-tx_size)] + tx_size > table[(ind-1, c)]:
-        return table[(ind-1, c-tx_size)] + tx_size
-    else:
-        return table[(ind-1, c)]
-
-
-def DP_fill(candidates, capacity):
-    temp_table = dict()
-    for c in range(capacity + 1):
-        if c >= candidates[0][2]:
-            temp_table[(0, c)] = candidates[0][2]
-        else:
-            temp_table[(0, c)] = 0
-
-    for ind in range(1, len(candidates)):
-        for c in range(capacity + 1):
-            temp_table[(ind, c)] = DP_fill_core(temp_table, ind, candidates[ind][2], c)
-
-    selected = find_selected_txs(capacity, candidates, temp_table)
-
-    return selected, temp_table[(len(candidates) - 1, capacity)]
-
-
-def best_effort(transactions, subsets, capacity):
-    selected_txs, covers = [], set()
-
-    selected_txs, filled_size = DP_fill(transactions, capacity)
 
-    for tx in selected_txs:
-        covers |= set(transactions[tx][1])
-
-    objective = subsets * (capacity - filled_size) + len(covers)
-
-    return objective, selected_txs
+# the best effort results with the filled size and the bound of the max fill for every capacity of a sweep.
+# The max fill knapsack is computed once for the largest capacity, the runs of consecutive transactions of the
+# same size are packed as bounded items with the same selection as the 0/1 traceback. With eps > 0 each
+# capacity is packed approximately, the filled size is within eps * capacity of the max fill (see
+# knapsack.approx_fill_selection)
+def best_effort_fills(transactions, subsets, capacities, eps=0):
+    transactions = as_transaction_set(transactions, subsets)
+    sizes = transactions.sizes.tolist()
 
+    if eps > 0:
+        fills = [approx_fill_selection(sizes, capacity, eps) for capacity in capacities]
+    else:
+        fills = [(selected_txs, filled_size, filled_size)
+                 for selected_txs, filled_size in run_fill_selections(sizes, capacities)]
 
-def run_exp(capacity, tx_count, subsets, seed, set_distribution, size_distribution, name, type=0):
-    print("processing seed: {}, subsets: {}, tx_count: {}, capacity: {}".format(seed, subsets, tx_count, capacity))
+    results = []
+    for capacity, (selected_txs, filled_size, fill_bound) in zip(capacities, fills):
+        covers = transactions.cover_union(selected_txs)
+        objective = subsets * (capacity - filled_size) + int(popcount(covers))
+        results.append((objective, selected_txs, filled_size, fill_bound))
 
-    transactions = read_data(
-        parse_path(tx_count, subsets, seed, set_distribution, size_distribution, real_type=type))
+    return results
 
-    start = time.time()
-    (objective, selected_txs) = best_effort(transactions, subsets, capacity)
-    end = time.time()
-    running_time = end - start
 
+def save_result(result, running_time, capacity, tx_count, subsets, seed, set_distribution, size_distribution, name, type=0, eps=0):
+    (objective, selected_txs, filled_size, fill_bound) = result
     if set_distribution and size_distribution:
         # result path for synthetic data result
         root_path = Path("../outputs/Best_effort/synthetic_data/{}".format(name))
@@ -90,16 +67,48 @@ def run_exp(capacity, tx_count, subsets, seed, set_distribution, size_distributi
     print('The objective value is:', file=f)
     print(objective, file=f)
     print('time cost : %.5f sec' % running_time, file=f)
+    if eps > 0:
+        print('The filled size is: {} (the max fill is at most {}, eps {})'.format(filled_size, fill_bound, eps), file=f)
     f.close()
     print("Done!")
 
 
+def run_exp(capacity, tx_count, subsets, seed, set_distribution, size_distribution, name, type=0, eps=0):
+    print("processing seed: {}, subsets: {}, tx_count: {}, capacity: {}".format(seed, subsets, tx_count, capacity))
+
+    transactions = load_data(tx_count, subsets, seed, set_distribution, size_distribution, real_type=type)
+
+    start = time.time()
+    result = best_effort_fills(transactions, subsets, [capacity], eps)[0]
+    end = time.time()
+    running_time = end - start
+
+    save_result(result, running_time, capacity, tx_count, subsets, seed, set_distribution, size_distribution, name, type, eps)
+
+
+# run_exp for every capacity of a sweep in one pass, the time cost of the pass is reported for each capacity
+def run_exp_multi(capacities, tx_count, subsets, seed, set_distribution, size_distribution, name, type=0, eps=0):
+    print("processing seed: {}, subsets: {}, tx_count: {}, capacities: {}".format(seed, subsets, tx_count, capacities))
+
+    transactions = load_data(tx_count, subsets, seed, set_distribution, size_distribution, real_type=type)
+
+    start = time.time()
+    results = best_effort_fills(transactions, subsets, capacities, eps)
+    end = time.time()
+    running_time = end - start
+
+    for capacity, result in zip(capacities, results):
+        save_result(result, running_time, capacity, tx_count, subsets, seed, set_distribution, size_distribution, name, type, eps)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--cfg', type=str, default="../cfgs/synthetic.yaml",
                         help='the configuration yaml file (see example.yaml)')
     parser.add_argument('--name', type=str, default="exp",
                         help='the name of the experiment')
+    parser.add_argument('--eps', type=float, default=0,
+                        help='pack approximately with the sizes scaled by the error bound eps (0 means exact)')
     opt = parser.parse_args()
 
     if Path(opt.cfg).exists():
@@ -121,23 +130,22 @@ if __name__ == '__main__':
                 name = "vary_txn"
                 if cfg['tx_type']:
                     for type in cfg['tx_type']:
-                        run_exp(default_capacity, txn, default_subset, seed, default_set_dist, default_size_dist, name, type= type)
+                        run_exp(default_capacity, txn, default_subset, seed, default_set_dist, default_size_dist, name, type=type, eps=opt.eps)
                 else:
-                    run_exp(default_capacity, txn, default_subset, seed, default_set_dist, default_size_dist, name)
+                    run_exp(default_capacity, txn, default_subset, seed, default_set_dist, default_size_dist, name, eps=opt.eps)
 
             # vary number of covered subsets
             for subsets in subsets_list:
                 name = "vary_subsets"
                 if cfg['tx_type']:
                     for type in cfg['tx_type']:
-                        run_exp(default_capacity, default_txn, subsets, seed, default_set_dist, default_size_dist, name, type=type)
+                        run_exp(default_capacity, default_txn, subsets, seed, default_set_dist, default_size_dist, name, type=type, eps=opt.eps)
                 else:
-                    run_exp(default_capacity, default_txn, subsets, seed, default_set_dist, default_size_dist, name)
+                    run_exp(default_capacity, default_txn, subsets, seed, default_set_dist, default_size_dist, name, eps=opt.eps)
 
-            # vary capacity
-            for capacity in capacity_list:
-                name = "vary_capacity"
-                run_exp(capacity, default_txn, default_subset, seed, default_set_dist, default_size_dist, name)
+            # vary capacity (all the capacities in one pass)
+            name = "vary_capacity"
+            run_exp_multi(capacity_list, default_txn, default_subset, seed, default_set_dist, default_size_dist, name, eps=opt.eps)
 
             # vary set distribution (mu and std)
             for set_dist in set_dist_list:
@@ -146,14 +154,14 @@ if __name__ == '__main__':
                     set_distribution = [set_dist, [str(mu), str(round(mu * 0.2, 1))]]
                     run_exp(default_capacity, default_txn, default_subset, seed, set_distribution,
                             default_size_dist,
-                            name)
+                            name, eps=opt.eps)
             for set_dist in set_dist_list:
                 for std_p in dist_std_proportion_list:
                     name = "vary_set_dist_std_{}".format(set_dist)
                     set_distribution = [set_dist, ['4', str(round(4 * std_p, 1))]]
                     run_exp(default_capacity, default_txn, default_subset, seed, set_distribution,
                             default_size_dist,
-                            name)
+                            name, eps=opt.eps)
 
             # vary size distribution (std only)
             for size_dist in size_dist_list:
@@ -162,6 +170,6 @@ if __name__ == '__main__':
                     size_distribution = [size_dist, ['100', str(int(100 * std_p))]]
                     run_exp(default_capacity, default_txn, default_subset, seed, default_set_dist,
                             size_distribution,
-                            name)
+                            name, eps=opt.eps)
     else:
         print("invalid configuration file!")
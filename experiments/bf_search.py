@@ -3,9 +3,14 @@
 # Author:
 # This file implements the brute-force search algorithm to find the optimal solution
 
-from utils import read_data, parse_path
+from utils import load_data, load_chunks
+from transaction_set import as_transaction_set, popcount
+from mitm_search import mitm_search
 import time
+import numpy as np
 from itertools import combinations
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 import argparse
 import yaml
 from pathlib import Path
@@ -15,46 +20,190 @@ def bf_search(transactions, subsets, counter1, counter2, capacity):
     opt_txs = None
     max_objective = subsets * capacity
     min_objective = max_objective
+    transactions = as_transaction_set(transactions, subsets)
+    sizes = transactions.sizes.tolist()
     length = len(transactions)
 
     for i in range(counter2, counter1 + 1):
-        for txs in combinations(transactions, i):
+        for comb in combinations(range(length), i):
             print('trying comb({}, {})'.format(length, i))
-            covers, size = set(), 0
-            for t in txs:
-                covers |= set(t[1])
-                size += t[2]
-            objective = max_objective - subsets * size + len(covers)
+            size = sum(sizes[t] for t in comb)
+            if size > capacity:
+                continue
+            objective = max_objective - subsets * size + int(popcount(transactions.cover_union(comb)))
             if objective < min_objective:
                 min_objective = objective
-                opt_txs = txs
+                opt_txs = tuple(transactions[t] for t in comb)
 
     return min_objective, opt_txs
 
 
-def run_exp(capacity, tx_count, subsets, seed, set_distribution, size_distribution, name):
+# enumerate the selections of one shard: the first len(prefix) transactions are fixed by prefix and the
+# others are walked in the binary reflected Gray code order, so each step adds or removes one transaction
+# and updates the size and the per-subset cover counters. Return (objective, step) of the best selection
+def gray_shard(sizes, covers, capacity, subsets, prefix):
+    fixed = len(prefix)
+    size, counts, covered = 0, [0] * (max([s for c in covers for s in c], default=-1) + 1), 0
+    for k, picked in enumerate(prefix):
+        if picked:
+            size += sizes[k]
+            for s in covers[k]:
+                counts[s] += 1
+                covered += counts[s] == 1
+
+    best = (subsets * (capacity - size) + covered, 0) if size <= capacity else (None, 0)
+    picked = [False] * len(sizes)
+    for step in range(1, 1 << (len(sizes) - fixed)):
+        # the bit flipped at this step is the number of trailing zeros of step
+        k = fixed + (step & -step).bit_length() - 1
+        picked[k] = not picked[k]
+        if picked[k]:
+            size += sizes[k]
+            for s in covers[k]:
+                counts[s] += 1
+                covered += counts[s] == 1
+        else:
+            size -= sizes[k]
+            for s in covers[k]:
+                counts[s] -= 1
+                covered -= counts[s] == 0
+        if size <= capacity:
+            objective = subsets * (capacity - size) + covered
+            if best[0] is None or objective < best[0]:
+                best = (objective, step)
+    return best
+
+
+# the exhaustive search (within the capacity) sharded over a process pool: each shard fixes the picks of
+# the first transactions and enumerates the rest in the Gray code order, the best selections of the
+# shards are reduced to the optimum (the first shard and step win the ties)
+def gray_search(transactions, subsets, capacity, workers=1, shard_bits=None):
+    transactions = as_transaction_set(transactions, subsets)
+    txs = transactions.to_txs()
+    sizes = [tx[2] for tx in txs]
+    covers = [sorted(set(tx[1])) for tx in txs]
+    if shard_bits is None:
+        shard_bits = (4 * workers - 1).bit_length()
+    shard_bits = min(shard_bits, len(txs))
+    prefixes = [[bool(i >> k & 1) for k in range(shard_bits)] for i in range(1 << shard_bits)]
+
+    args = [[sizes] * len(prefixes), [covers] * len(prefixes), [capacity] * len(prefixes),
+            [subsets] * len(prefixes), prefixes]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(gray_shard, *args))
+    else:
+        results = list(map(gray_shard, *args))
+
+    min_objective, opt_txs = subsets * capacity, ()
+    for prefix, (objective, step) in zip(prefixes, results):
+        if objective is not None and objective < min_objective:
+            gray = step ^ (step >> 1)
+            picked = prefix + [bool(gray >> k & 1) for k in range(len(txs) - shard_bits)]
+            min_objective, opt_txs = objective, tuple(tx for tx, p in zip(txs, picked) if p)
+    return min_objective, opt_txs
+
+
+# the exact branch-and-bound search of the same objective within the capacity. The union of the covered
+# subsets U is searched instead of the transactions: for a fixed U the best selection is the max fill of
+# the transactions within U, so the objective is min over U of subsets * (capacity - fill(U)) + |U|.
+# A node fixes the subsets included in (and excluded from) U, which are updated incrementally as bitmasks,
+# and the subsets are branched depth-first (including before excluding). For a node, if U adds e subsets to
+# the included ones, the transactions it can pick add at most e of them, so
+# subsets * (capacity - max fill of those transactions) + |included| + e is a lower bound, and the node is
+# pruned when the minimum over e is not better than the best. The fills are exact subset sums (bitsets)
+def bnb_search(transactions, subsets, capacity):
+    transactions = as_transaction_set(transactions, subsets)
+    txs = transactions.to_txs()
+    masks = [sum(1 << s for s in set(tx[1])) for tx in txs]
+    candidates = [t for t in range(len(txs)) if txs[t][2] <= capacity]
+    full = (1 << (capacity + 1)) - 1
+
+    # branch on the subsets covered by more (size of) transactions first
+    weights = [0] * transactions.subsets
+    for t in candidates:
+        for s in set(txs[t][1]):
+            weights[s] += txs[t][2]
+    order = sorted(range(transactions.subsets), key=lambda s: -weights[s])
+
+    min_objective, opt_union = subsets * capacity, 0
+    stack = [(0, 0, 0)]     # (depth, included subsets, excluded subsets)
+    while stack:
+        depth, included, excluded = stack.pop()
+        included_count = bin(included).count('1')
+        # the transactions within the possible unions, by the number of subsets they add to the included ones
+        allowed = sorted((bin(masks[t] & ~included).count('1'), txs[t][2], t)
+                         for t in candidates if masks[t] & excluded == 0)
+        reachable, bound = 1, subsets * capacity + included_count
+        for i, (new, size, t) in enumerate(allowed):
+            reachable = (reachable | (reachable << size)) & full
+            if i + 1 == len(allowed) or allowed[i + 1][0] != new:
+                bound = min(bound, subsets * (capacity - reachable.bit_length() + 1) + included_count + new)
+                if new == 0 and bound < min_objective:
+                    # the transactions within the included subsets are a selection
+                    min_objective, opt_union = bound, included
+        if bound >= min_objective or depth == len(order):
+            continue
+        s = order[depth]
+        stack.append((depth + 1, included, excluded | (1 << s)))
+        if any(masks[t] >> s & 1 for _, _, t in allowed):
+            stack.append((depth + 1, included | (1 << s), excluded))
+
+    # the max fill selection of the transactions within the best union
+    within = [t for t in candidates if masks[t] & ~opt_union == 0]
+    rows = [1]
+    for t in within:
+        rows.append((rows[-1] | (rows[-1] << txs[t][2])) & full)
+    fill = rows[-1].bit_length() - 1
+    selected = []
+    for i in range(len(within), 0, -1):
+        if not rows[i - 1] >> fill & 1:
+            selected.append(within[i - 1])
+            fill -= txs[within[i - 1]][2]
+    selected = sorted(selected)
+    opt_txs = tuple(txs[t] for t in selected)
+    min_objective = subsets * (capacity - sum(tx[2] for tx in opt_txs)) + int(popcount(transactions.cover_union(selected)))
+    return min_objective, opt_txs
+
+
+# compute the maximum (counter1) and minimum (counter2) number of transactions that can be packed
+# within the capacity, the sizes are consumed chunk by chunk and only the count of each size is kept
+def size_bounds(size_chunks, capacity):
+    size_count = Counter()
+    for sizes in size_chunks:
+        values, counts = np.unique(sizes, return_counts=True)
+        size_count.update(dict(zip(values.tolist(), counts.tolist())))
+
+    bounds = []
+    for reverse in (False, True):
+        sum_size, counter = 0, 0
+        for s in sorted(size_count, reverse=reverse):
+            taken = size_count[s] if s == 0 else min(size_count[s], max(capacity - sum_size, 0) // s)
+            sum_size += taken * s
+            counter += taken
+            if taken < size_count[s]:
+                break
+        bounds.append(counter)
+    return bounds[0], bounds[1]
+
+
+def run_exp(capacity, tx_count, subsets, seed, set_distribution, size_distribution, name, method='bnb', workers=1):
     print("processing seed: {}, subsets: {}, tx_count: {}, capacity: {}".format(seed, subsets, tx_count, capacity))
 
-    transactions = read_data(
-        parse_path(tx_count, subsets, seed, set_distribution, size_distribution))
-
-    # compute the maximum number of tx to pick to reduce the search space
-    sizes, sum_size, counter1, counter2 = [], 0, 0, 0
-    for tx in transactions:
-        sizes.append(tx[2])
-    sizes.sort()
-    for s in sizes:
-        sum_size += s
-        if sum_size <= capacity:
-            counter1 += 1
-    sum_size = 0
-    for s in reversed(sizes):
-        sum_size += s
-        if sum_size <= capacity:
-            counter2 += 1
+    transactions = load_data(tx_count, subsets, seed, set_distribution, size_distribution)
 
     start = time.time()
-    (opt_txs, objective) = bf_search(transactions, subsets, counter1, counter2, capacity)
+    if method == 'bf':
+        # compute the maximum number of tx to pick to reduce the search space
+        size_chunks = (chunk[3] for chunk in load_chunks(tx_count, subsets, seed, set_distribution, size_distribution))
+        counter1, counter2 = size_bounds(size_chunks, capacity)
+        (objective, opt_txs) = bf_search(transactions, subsets, counter1, counter2, capacity)
+    elif method == 'gray':
+        (objective, opt_txs) = gray_search(transactions, subsets, capacity, workers)
+    elif method == 'mitm':
+        (objective, opt_txs) = mitm_search(transactions, subsets, capacity)
+    else:
+        (objective, opt_txs) = bnb_search(transactions, subsets, capacity)
     end = time.time()
     running_time = end - start
 
@@ -78,6 +227,11 @@ if __name__ == '__main__':
                         help='the configuration yaml file (see example.yaml)')
     parser.add_argument('--name', type=str, default="exp",
                         help='the name of the experiment')
+    parser.add_argument('--method', type=str, default="bnb", choices=["bnb", "bf", "gray", "mitm"],
+                        help='the exact search: branch-and-bound (bnb), enumeration (bf), sharded Gray code '
+                             'enumeration (gray) or meet-in-the-middle (mitm, up to 64 subsets)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes of the gray method')
     opt = parser.parse_args()
 
     if Path(opt.cfg).exists():
@@ -97,15 +251,15 @@ if __name__ == '__main__':
             # vary number of candidate transactions
             for txn in txn_list:
                 name = "vary_txn"
-                run_exp(default_capacity, txn, default_subset, seed, default_set_dist, default_size_dist, name)
+                run_exp(default_capacity, txn, default_subset, seed, default_set_dist, default_size_dist, name, opt.method, opt.workers)
             # vary number of covered subsets
             for subsets in subsets_list:
                 name = "vary_subsets"
-                run_exp(default_capacity, default_txn, subsets, seed, default_set_dist, default_size_dist, name)
+                run_exp(default_capacity, default_txn, subsets, seed, default_set_dist, default_size_dist, name, opt.method, opt.workers)
             # vary capacity
             for capacity in capacity_list:
                 name = "vary_capacity"
-                run_exp(capacity, default_txn, default_subset, seed, default_set_dist, default_size_dist, name)
+                run_exp(capacity, default_txn, default_subset, seed, default_set_dist, default_size_dist, name, opt.method, opt.workers)
             # vary set distribution (mu and std)
             for set_dist in set_dist_list:
                 for mu in set_dist_mu_list:
@@ -113,14 +267,14 @@ if __name__ == '__main__':
                     set_distribution = [set_dist, [str(mu), str(round(mu * 0.2, 1))]]
                     run_exp(default_capacity, default_txn, default_subset, seed, set_distribution,
                             default_size_dist,
-                            name)
+                            name, opt.method, opt.workers)
             for set_dist in set_dist_list:
                 for std_p in dist_std_proportion_list:
                     name = "vary_set_dist_std_{}".format(set_dist)
                     set_distribution = [set_dist, ['4', str(round(4 * std_p, 1))]]
                     run_exp(default_capacity, default_txn, default_subset, seed, set_distribution,
                             default_size_dist,
-                            name)
+                            name, opt.method, opt.workers)
             # vary size distribution (std only)
             for size_dist in size_dist_list:
                 for std_p in dist_std_proportion_list:
@@ -128,6 +282,6 @@ if __name__ == '__main__':
                     size_distribution = [size_dist, ['100', str(int(100 * std_p))]]
                     run_exp(default_capacity, default_txn, default_subset, seed, default_set_dist,
                             size_distribution,
-                            name)
+                            name, opt.method, opt.workers)
     else:
         print("invalid configuration file!")
@@ -0,0 +1,61 @@
+# !/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author:
+# This file implements the co-access graph of the subsets (two subsets are adjacent if some transaction covers both)
+
+from transaction_set import as_transaction_set
+
+
+# The masks are the bits of Python integers (bit s for the subset s). The graph is built in one pass over the
+# covers of the transactions: the neighbors of each covered subset get the mask of the transaction, and the
+# mask is also added to the smallest covered subset. The prefix or of the latter over the subsets 0..j holds
+# the subsets covered together with some k <= j, so the frontier of j (the subsets l > j sharing a transaction
+# with some k <= j, used to prune the states of dp.py) is its part above j
+class CoAccessGraph:
+    def __init__(self, transactions, subsets=None):
+        transactions = as_transaction_set(transactions, subsets)
+        self.subsets = transactions.subsets
+        offsets, covers = transactions.offsets.tolist(), transactions.covers.tolist()
+
+        # the union of the covered subsets of the transactions covering each subset (itself included)
+        self.reach = [0] * self.subsets
+        first = [0] * self.subsets
+        for i in range(len(offsets) - 1):
+            sets = covers[offsets[i]:offsets[i + 1]]
+            if not sets:
+                continue
+            mask = 0
+            for s in sets:
+                mask |= 1 << s
+            for s in sets:
+                self.reach[s] |= mask
+            first[min(sets)] |= mask
+
+        self.frontiers, prefix = [], 0
+        for j in range(self.subsets):
+            prefix |= first[j]
+            self.frontiers.append(prefix >> (j + 1) << (j + 1))
+
+    # the mask of the subsets sharing a transaction with s
+    def neighbor_mask(self, s):
+        return self.reach[s] & ~(1 << s)
+
+    def neighbors(self, s):
+        return mask_to_list(self.neighbor_mask(s))
+
+    def adjacent(self, s, t):
+        return s != t and self.reach[s] >> t & 1 == 1
+
+    # the mask of the subsets l > j covered together with some k <= j
+    def frontier(self, j):
+        return self.frontiers[j] if 0 <= j < self.subsets else 0
+
+
+def mask_to_list(mask):
+    sets, s = [], 0
+    while mask:
+        if mask & 1:
+            sets.append(s)
+        mask >>= 1
+        s += 1
+    return sets
@@ -3,86 +3,60 @@
 # Author:
 # This file implements the DP-based algorithm
 
-from utils import read_data, parse_path
+from utils import load_data
+from transaction_set import as_transaction_set
+from knapsack import fill_vector
+from co_access import CoAccessGraph
+import numpy as np
 import time
 import argparse
 import yaml
 from pathlib import Path
+from collections import OrderedDict
 
+# the budget of the cached fill vectors of compute_c_v (bytes)
+FILL_CACHE_BYTES = 1 << 28
 
-# convert the h_plus string to a set
-def table_entry_to_set(entry):
-    if entry == '()':
-        return set()
-    else:
-        return set(map(int, entry[1:-1].split(',')))
-
-
-def set_to_table_entry(the_set):
-    the_list = list(the_set)
-    the_list.sort()
-    the_set = ','.join(map(str, the_list))
-    return '(' + the_set + ')'
-
-
-def adj_graph(j, subsets):
-    global transactions
-    indices = []
-    sets = set()
-
-    for tx in transactions:
-        for k in range(j + 1):
-            for l in range(j + 1, subsets):
-                if k in tx[1] and l in tx[1]:
-                    sets.add(l)
-
-    sets = list(sets)
-    return (indices, sets)
-
-
-def DP_fill_core(table, ind, tx_size, c):
-    if c < 1:
-        return 0
-    if c-tx_size < 0:
-        return table[(ind-1, c)]
-
-    if table[(ind-1, c-tx_size)] + tx_size > table[(ind-1, c)]:
-        return table[(ind-1, c-tx_size)] + tx_size
-    else:
-        return table[(ind-1, c)]
 
+# The frontier h_plus of a state is the set of subsets l > j that may still be covered by the picked
+# transactions, kept as the bits of a Python integer. h_table[j] is the frontier of j in the co-access graph
+# (the subsets l > j sharing a transaction with some k <= j), the frontier passed to j - 1 is h_plus & h_table[j - 1].
+# Each state (j, frontier) is solved once for all the capacities 0..C: its value is a vector over the
+# capacities, the memo table is keyed by the packed integer of (j, frontier), see table_key
 
-def DP_fill(candidates, capacity):
-    temp_table = dict()
-    print('entering DP fill with capacity {} and {} candidates'.format(capacity, len(candidates)))
-    for c in range(capacity + 1):
-        if c >= candidates[0][2]:
-            temp_table[(0, c)] = candidates[0][2]
-        else:
-            temp_table[(0, c)] = 0
 
-    for ind in range(1, len(candidates)):
-        for c in range(capacity + 1):
-            temp_table[(ind, c)] = DP_fill_core(temp_table, ind, candidates[ind][2], c)
-    return temp_table[(len(candidates) - 1, capacity)]
+# the per-run index of the candidates: the transactions covering each subset j, their covered subsets
+# (as integer masks) and the union of these masks (the reach of j in the co-access graph), only the bits
+# of the frontier in the union decide the candidates of j, so (j, frontier & union) is the key of the
+# cached (candidates, c_star). The graph of the run is built here if it is not given
+def build_candidate_index(subsets, graph=None):
+    global subset_txs, tx_masks, tx_sizes, cover_reach, fill_cache, fill_cache_size
+    subset_txs = transactions.subset_index()
+    tx_masks = transactions.int_masks()
+    tx_sizes = transactions.sizes.tolist()
+    cover_reach = (graph or CoAccessGraph(transactions, subsets)).reach
+    fill_cache, fill_cache_size = OrderedDict(), 0
 
 
+# the vectors (over the capacities 0..capacity) of c_star, the max fill of the candidates of j, and of
+# v_star = 1 - subsets * c_star, the gain of picking j. The least recently used entries of the cache are
+# dropped beyond FILL_CACHE_BYTES
 def compute_c_v(j, h_plus, capacity, subsets):
-    global transactions
-
-    candidates = []
-    h_plus.add(j)
-    for tx in transactions:
-        if j in tx[1] and set(tx[1]).issubset(h_plus):
-            candidates.append(tx)
-
-    total_cap = 0
-    for tx in candidates:
-        total_cap += tx[2]
-    if total_cap > capacity:
-        c_star = DP_fill(candidates, capacity)
+    global fill_cache_size
+
+    # candidates cover j and their covered subsets are all in h_plus + j
+    accessible = (h_plus | 1 << j) & cover_reach[j]
+    key = table_key(j, accessible)
+    if key in fill_cache:
+        fill_cache.move_to_end(key)
+        c_star = fill_cache[key][1]
     else:
-        c_star = total_cap
+        candidates = [t for t in subset_txs[j] if tx_masks[t] & ~accessible == 0]
+        c_star = fill_vector([tx_sizes[t] for t in candidates], capacity)
+        fill_cache[key] = (candidates, c_star)
+        fill_cache_size += c_star.nbytes
+        while fill_cache_size > FILL_CACHE_BYTES and len(fill_cache) > 1:
+            fill_cache_size -= fill_cache.popitem(last=False)[1][1].nbytes
 
     v_star = 1 - subsets * c_star # len(h_plus) - subsets * c_star
     return c_star, v_star
@@ -96,89 +70,99 @@ def powerset(s):
         yield [ss for mask, ss in zip(masks, s) if i & mask]
 
 
-def compute_h_table(subsets):
+# the frontiers of the co-access graph of the run (built here if it is not given)
+def compute_h_table(subsets, graph=None):
+    global transactions
+    graph = graph or CoAccessGraph(transactions, subsets)
     h_table = dict()
-    h_table[-1] = [[],[]]
+    h_table[-1] = 0
     for j in range(subsets-1):
-        h_table[j] = adj_graph(j, subsets)
-    h_table[subsets-1] = [[],[]]
+        h_table[j] = graph.frontier(j)
+    h_table[subsets-1] = 0
     return h_table
 
 
-def set_of_pick(j, h_plus):
-    global h_table
-    h_plus.add(j)
-    temp = h_plus.intersection(set(h_table[j-1][1]))
-    if not temp:
-        return ('()', set())
-    else:
-        return (set_to_table_entry(temp), temp)
+# the packed key of the state (j, h_plus): j + 1 + (subsets + 1) * h_plus
+def table_key(j, h_plus):
+    return j + 1 + subset_width * h_plus
 
 
-def set_of_unpick(j, h_plus):
-    global h_table
-    temp = h_plus.intersection(set(h_table[j-1][1]))
-    if not temp:
-        return ('()', set())
-    else:
-        return (set_to_table_entry(temp), temp)
+# the number of parents of every state reachable from the top state (subsets - 1, empty frontier)
+def count_uses(subsets):
+    uses = dict()
+    level = {0}
+    for j in range(subsets - 1, -1, -1):
+        adj = h_table[j-1]
+        children = set()
+        for h_plus in level:
+            for child in (h_plus & adj, (h_plus | 1 << j) & adj):
+                uses[table_key(j-1, child)] = uses.get(table_key(j-1, child), 0) + 1
+                children.add(child)
+        level = children
+    return uses
+
 
+# the vector of a state for one of its parents, the vector is dropped from the table after its last use
+# (the vectors of all the states of a level may not fit in memory together)
+def use_entry(key):
+    uses[key] -= 1
+    if uses[key] == 0:
+        return table.pop(key)
+    return table[key]
 
+
+# the vector of the values of the state (j, h_plus) over the capacities 0..capacity, without the base
+# subsets * capacity of the empty selection: value[c] = min(unpicked[c], picked[c - c_star[c]] + v_star[c])
 def DP_core(j, h_plus, capacity, subsets, show = False):
     global table
 
-    # print('computing the entry: ({}, {}, {})'.format(j, h_plus, capacity))
+    # print('computing the entry: ({}, {})'.format(j, h_plus))
 
-    if (j-1, set_of_unpick(j, h_plus)[0], capacity) not in table:
-        table[(j-1, set_of_unpick(j, h_plus)[0], capacity)] = DP_core(j-1, set_of_unpick(j, h_plus)[1], capacity, subsets, show=show)
+    adj = h_table[j-1]
+    unpick = h_plus & adj
+    key = table_key(j-1, unpick)
+    if key not in table:
+        table[key] = DP_core(j-1, unpick, capacity, subsets, show=show)
+    temp1 = use_entry(key)
 
-    temp1 = table[(j-1, set_of_unpick(j, h_plus)[0], capacity)]
     c_star, v_star = compute_c_v(j, h_plus, capacity, subsets)
-    if (j-1, set_of_pick(j, h_plus)[0], capacity - c_star) not in table:
-        table[(j-1, set_of_pick(j, h_plus)[0], capacity - c_star)] = DP_core(j-1, set_of_pick(j, h_plus)[1], capacity - c_star, subsets, show=show)
+    pick = (h_plus | 1 << j) & adj
+    key = table_key(j-1, pick)
+    if key not in table:
+        table[key] = DP_core(j-1, pick, capacity, subsets, show=show)
+    temp2 = use_entry(key)[capacity_range - c_star] + v_star
 
-    temp2 = table[(j-1, set_of_pick(j, h_plus)[0], capacity - c_star)] + v_star
+    return np.minimum(temp1, temp2)
 
-    if temp1 < temp2:
-        return temp1
-    else:
-        # if show:
-        #     pick_list.append(j)
-        return temp2
 
+def DP(subsets, capacity, graph=None):
+    return DP_multi(subsets, [capacity], graph)[0]
 
-def DP(subsets, capacity):
-    global default_value, table
 
-    # initialize the table
-    for i in range(capacity + 1):
-        # initialize all (0, x) entries
-        table[(-1, '()', i)] = default_value
+# the objectives of every capacity of a sweep, the states are solved once for the largest capacity
+def DP_multi(subsets, capacities, graph=None):
+    global table, transactions, subset_width, capacity_range, uses
 
-    table[(subsets-1, '()', capacity)] = DP_core(subsets-1, set(), capacity, subsets)
+    transactions = as_transaction_set(transactions, subsets)
+    subset_width = subsets + 1
+    capacity = max(capacities)
+    capacity_range = np.arange(capacity + 1)
+    uses = count_uses(subsets)
+    build_candidate_index(subsets, graph)
 
-    objective = table[(subsets-1, '()', capacity)]
+    # initialize the table, all the (-1, x) entries are the empty selection
+    table[table_key(-1, 0)] = np.zeros(capacity + 1, dtype=np.int64)
 
-    # DP_core(subsets - 1, set(), capacity, subsets, show=True)
+    table[table_key(subsets-1, 0)] = DP_core(subsets-1, 0, capacity, subsets)
 
-    return 'not implemented', objective
+    values = table[table_key(subsets-1, 0)]
 
+    # DP_core(subsets - 1, 0, capacity, subsets, show=True)
 
-def run_exp(capacity, tx_count, subsets, seed, set_distribution, size_distribution, name, type=0):
-    global h_table, table, transactions, default_value
+    return [('not implemented', subsets * c + int(values[c])) for c in capacities]
 
-    print("processing seed: {}, subsets: {}, tx_count: {}, capacity: {}".format(seed, subsets, tx_count, capacity))
-    transactions = read_data(
-        parse_path(tx_count, subsets, seed, set_distribution, size_distribution, real_type=type))
-
-    start = time.time()
-    h_table = compute_h_table(subsets)  # used for state pruning
-    table = dict()
-    default_value = subsets * capacity
-    (opt_txs, objective) = DP(subsets, capacity)
-    end = time.time()
-    running_time = end - start
 
+def save_result(objective, running_time, capacity, tx_count, subsets, seed, set_distribution, size_distribution, name, type=0):
     if set_distribution and size_distribution:
         # result path for synthetic data result
         root_path = Path("../outputs/DP/synthetic_data/{}".format(name))
@@ -202,6 +186,44 @@ def run_exp(capacity, tx_count, subsets, seed, set_distribution, size_distributi
     print("Done!")
 
 
+def run_exp(capacity, tx_count, subsets, seed, set_distribution, size_distribution, name, type=0):
+    global h_table, table, transactions
+
+    print("processing seed: {}, subsets: {}, tx_count: {}, capacity: {}".format(seed, subsets, tx_count, capacity))
+    transactions = as_transaction_set(
+        load_data(tx_count, subsets, seed, set_distribution, size_distribution, real_type=type), subsets)
+
+    start = time.time()
+    graph = CoAccessGraph(transactions, subsets)
+    h_table = compute_h_table(subsets, graph)  # used for state pruning
+    table = dict()
+    (opt_txs, objective) = DP(subsets, capacity, graph)
+    end = time.time()
+    running_time = end - start
+
+    save_result(objective, running_time, capacity, tx_count, subsets, seed, set_distribution, size_distribution, name, type)
+
+
+# run_exp for every capacity of a sweep in one pass, the time cost of the pass is reported for each capacity
+def run_exp_multi(capacities, tx_count, subsets, seed, set_distribution, size_distribution, name, type=0):
+    global h_table, table, transactions
+
+    print("processing seed: {}, subsets: {}, tx_count: {}, capacities: {}".format(seed, subsets, tx_count, capacities))
+    transactions = as_transaction_set(
+        load_data(tx_count, subsets, seed, set_distribution, size_distribution, real_type=type), subsets)
+
+    start = time.time()
+    graph = CoAccessGraph(transactions, subsets)
+    h_table = compute_h_table(subsets, graph)  # used for state pruning
+    table = dict()
+    results = DP_multi(subsets, capacities, graph)
+    end = time.time()
+    running_time = end - start
+
+    for capacity, (opt_txs, objective) in zip(capacities, results):
+        save_result(objective, running_time, capacity, tx_count, subsets, seed, set_distribution, size_distribution, name, type)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--cfg', type=str, default="../cfgs/synthetic.yaml",
@@ -223,7 +245,7 @@ if __name__ == '__main__':
         dist_std_proportion_list = cfg['dist_std_proportion_list']
         default_capacity, capacity_list =  cfg['default_capacity'],  cfg['capacity_list']
 
-        global h_table, table, transactions, default_value
+        global h_table, table, transactions
 
         for seed in seed_list:
             # vary number of candidate transactions
@@ -245,10 +267,9 @@ if __name__ == '__main__':
                         run_exp(default_capacity, default_txn, subsets, seed, default_set_dist, default_size_dist, name, type=type)
                 else:
                     run_exp(default_capacity, default_txn, subsets, seed, default_set_dist, default_size_dist, name)
-            # vary capacity
-            for capacity in capacity_list:
-                name = "vary_capacity"
-                run_exp(capacity, default_txn, default_subset, seed, default_set_dist, default_size_dist, name)
+            # vary capacity (all the capacities in one pass)
+            name = "vary_capacity"
+            run_exp_multi(capacity_list, default_txn, default_subset, seed, default_set_dist, default_size_dist, name)
             # vary set distribution (mu and std)
             for set_dist in set_dist_list:
                 for mu in set_dist_mu_list:
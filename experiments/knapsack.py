@@ -0,0 +1,223 @@
+# !/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author:
+# This file implements the 0/1 knapsack (max fill) kernel shared by the algorithms
+
+from collections import Counter
+import numpy as np
+
+# The reachable sums of a prefix of the items are kept as the bits of a Python integer (bit c is set
+# if some of the items sum to c), so adding an item is one shift and one or over capacity + 1 bits.
+# fill(row, c), the largest reachable sum <= c, equals the entry (i, c) of the DP table of the max fill,
+# and the rows of all the prefixes form the (bit-packed) table used to reconstruct the selection.
+
+
+def low_bits(c):
+    return (1 << (c + 1)) - 1
+
+
+# the largest reachable sum of the row within the capacity c
+def fill(row, c):
+    return (row & low_bits(c)).bit_length() - 1
+
+
+# the rows of the reachable sums (within the capacity) of the prefixes of the items
+def reachable_rows(sizes, capacity):
+    full = low_bits(capacity)
+    rows, row = [], 1
+    for size in sizes:
+        row = (row | (row << size)) & full
+        rows.append(row)
+    return rows
+
+
+# the reachable sums of all the items within the capacity, the items of the same size are added as the
+# binary pieces of their count (see bounded_items)
+def reachable_row(sizes, capacity):
+    full = low_bits(capacity)
+    row = 1
+    for size, count in Counter(sizes).items():
+        for piece in binary_pieces(count):
+            row = (row | (row << (size * piece))) & full
+    return row
+
+
+# the max fill of the items within the capacity
+def max_fill(sizes, capacity):
+    return reachable_row(sizes, capacity).bit_length() - 1
+
+
+# the max fill of the items within every capacity 0..capacity, as an int64 array
+def fill_vector(sizes, capacity):
+    row = reachable_row(sizes, capacity)
+    bits = np.unpackbits(np.frombuffer(row.to_bytes(capacity // 8 + 1, 'little'), dtype=np.uint8),
+                         bitorder='little')[:capacity + 1]
+    # the fill is a step function of the capacity: each reachable sum up to the next one
+    sums = np.flatnonzero(bits)
+    return np.repeat(sums, np.diff(np.append(sums, capacity + 1)))
+
+
+# split a count into the pieces 1, 2, 4, ..., rest, every number from 0 to count is a sum of some pieces
+def binary_pieces(count):
+    pieces, piece = [], 1
+    while count > 0:
+        pieces.append(min(piece, count))
+        count -= pieces[-1]
+        piece *= 2
+    return pieces
+
+
+# group the items by size (the positions of each size in the given order) and split every group into
+# the pieces of binary_pieces, the 0/1 knapsack of the pieces (size, piece) is the bounded knapsack
+# of the sizes, with much fewer items when the sizes repeat
+def bounded_items(sizes, order=None):
+    members = dict()
+    for pos in (range(len(sizes)) if order is None else order):
+        members.setdefault(sizes[pos], []).append(pos)
+    items = [(size, piece) for size, positions in members.items() for piece in binary_pieces(len(positions))]
+    return members, items
+
+
+# the max fill and the selected positions for every capacity of a sweep, the rows are computed once for the
+# largest capacity. It is solved as the bounded knapsack of the sizes: the count of each size is traced back
+# from the pieces and expanded to the first positions (in the given order) of the size
+def bounded_fill_selections(sizes, capacities, order=None):
+    if len(sizes) == 0 or len(capacities) == 0 or max(capacities) < 0:
+        return [([], 0) for _ in capacities]
+    members, items = bounded_items(sizes, order)
+    item_sizes = [size * piece for size, piece in items]
+    rows = reachable_rows(item_sizes, max(capacities))
+
+    results = []
+    for c in capacities:
+        if c < 0:
+            results.append(([], 0))
+            continue
+        counts = Counter()
+        for ind in traceback(rows, item_sizes, c):
+            counts[items[ind][0]] += items[ind][1]
+        selected = sorted((pos for size, count in counts.items() for pos in members[size][:count]), reverse=True)
+        results.append((selected, fill(rows[-1], c)))
+    return results
+
+
+# the max fill and the selected positions (from the last one) for every capacity of a sweep, the same selections
+# as the traceback of the 0/1 knapsack of the items in their order. The runs of consecutive items of the same
+# size are packed as one bounded item (binary pieces), and the traceback takes from each run (from the last one)
+# its first t items for the least t whose remaining sum is reachable by the items before the run, as the 0/1
+# traceback keeps the first items of a run. The rows are only kept at the ends of the runs
+def run_fill_selections(sizes, capacities):
+    if len(sizes) == 0 or len(capacities) == 0 or max(capacities) < 0:
+        return [([], 0) for _ in capacities]
+    runs, start = [], 0
+    for pos in range(1, len(sizes) + 1):
+        if pos == len(sizes) or sizes[pos] != sizes[start]:
+            runs.append((sizes[start], start, pos - start))
+            start = pos
+
+    full = low_bits(max(capacities))
+    rows, row = [], 1
+    for size, start, count in runs:
+        for piece in binary_pieces(count):
+            row = (row | (row << (size * piece))) & full
+        rows.append(row)
+
+    results = []
+    for c in capacities:
+        if c < 0:
+            results.append(([], 0))
+            continue
+        filled = fill(rows[-1], c)
+        selected, rest = [], filled
+        for ind in range(len(runs) - 1, -1, -1):
+            size, start, count = runs[ind]
+            before = rows[ind - 1] if ind > 0 else 1
+            taken = 0
+            while not (rest - taken * size >= 0 and before >> (rest - taken * size) & 1):
+                taken += 1
+            selected.extend(range(start + taken - 1, start - 1, -1))
+            rest -= taken * size
+        results.append((selected, filled))
+    return results
+
+
+# the largest number of items that fit in the capacity (the smallest ones)
+def max_item_count(sizes, capacity):
+    count, total = 0, 0
+    for size in sorted(sizes):
+        if total + size > capacity:
+            break
+        total += size
+        count += 1
+    return count
+
+
+# the approximate max fill within eps * capacity of the exact one. Only the large items (of size at least
+# eps * capacity, at most k <= 1 / eps of them fit) go through the DP, their sizes are scaled down (rounded down)
+# by K = max(1, eps * capacity / k) and for every scaled sum v (at most capacity / K, about k / eps <= 1 / eps^2)
+# the DP keeps the least real sum of the items (as the pieces of bounded_items) whose scaled sizes sum to v.
+# An optimal selection of scaled sum v has a real sum below K * v + K * k, and the kept selection of v is
+# feasible with a real sum of at least K * v, so the best kept selection loses less than K * k <= eps * capacity
+# against the max fill of the large items. The unselected items that still fit (the small ones) are then added
+# in the given order: if one of the small items does not fit the fill is above (1 - eps) * capacity, otherwise
+# all of them are added to a large selection within eps * capacity of the large part of the optimum. The max
+# fill is at most K * v + (K - 1) * k for the largest feasible v plus the sum of the small sizes. The DP does a
+# few int64 passes over capacity / K entries per item and the exact row one shift over capacity / 64 words, so
+# for K < 16 the exact fill is used. Return (selected positions, fill, bound of the max fill)
+def approx_fill_selection(sizes, capacity, eps, order=None):
+    if len(sizes) == 0 or capacity < 0:
+        return [], 0, 0
+    order = range(len(sizes)) if order is None else order
+    large = [pos for pos in order if eps * capacity <= sizes[pos] <= capacity]
+    k = max(max_item_count([sizes[pos] for pos in large], capacity), 1)
+    scale = max(1, int(eps * capacity / k))
+    if scale < 16:
+        selected, filled = bounded_fill_selections(sizes, [capacity], order)[0]
+        return selected, filled, filled
+
+    top = capacity // scale
+    members, items = bounded_items(sizes, large)
+    items = [(size, piece) for size, piece in items if size * piece <= capacity]
+    # least[v]: the least real sum of scaled sum v (capacity + 1 if there is none within the capacity)
+    least = np.full(top + 1, capacity + 1, dtype=np.int64)
+    least[0] = 0
+    taken = np.zeros((len(items), top + 1), dtype=bool)
+    for ind, (size, piece) in enumerate(items):
+        value = size // scale * piece
+        if value > top:
+            continue
+        candidate = np.full(top + 1, capacity + 1, dtype=np.int64)
+        candidate[value:] = np.minimum(least[:top + 1 - value] + size * piece, capacity + 1)
+        taken[ind] = candidate < least
+        least = np.minimum(least, candidate)
+
+    feasible = np.flatnonzero(least <= capacity)
+    small = sum(sizes[pos] for pos in order if sizes[pos] < eps * capacity)
+    bound = min(capacity, scale * int(feasible[-1]) + (scale - 1) * k + small)
+    v = int(feasible[np.argmax(least[feasible])])
+    counts = Counter()
+    for ind in range(len(items) - 1, -1, -1):
+        if taken[ind, v]:
+            counts[items[ind][0]] += items[ind][1]
+            v -= items[ind][0] // scale * items[ind][1]
+    selected = [pos for size, count in counts.items() for pos in members[size][:count]]
+
+    filled, chosen = sum(sizes[pos] for pos in selected), set(selected)
+    for pos in order:
+        if pos not in chosen and filled + sizes[pos] <= capacity:
+            selected.append(pos)
+            filled += sizes[pos]
+    return sorted(selected, reverse=True), filled, max(bound, filled)
+
+
+# the positions of the selected items (from the last one) for the capacity, the item i is selected if the
+# fill of the items 0..i is larger than the fill of the items 0..i-1 at the remaining capacity, the same
+# selection as the traceback of the DP table. The rows may be computed for any larger capacity
+def traceback(rows, sizes, capacity):
+    selected, c = [], capacity
+    for ind in range(len(sizes) - 1, -1, -1):
+        current = fill(rows[ind], c)
+        if current > (fill(rows[ind - 1], c) if ind > 0 else 0):
+            selected.append(ind)
+            c -= sizes[ind]
+    return selected
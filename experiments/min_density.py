@@ -3,7 +3,10 @@
 # Author:
 # The implementation of the minimum-density based algorithm
 
-from utils import read_data, parse_path
+from utils import load_data, load_chunks, parse_path, arrays_to_txs
+from transaction_set import TransactionSet, popcount
+from knapsack import bounded_fill_selections
+import numpy as np
 import time
 import argparse
 import yaml
@@ -11,17 +14,26 @@ from pathlib import Path
 
 
 def preprocess_txs(txs):
+    return preprocess_chunks([txs])
+
+
+# group the transactions with the same covered subsets, the input is consumed chunk by chunk
+# (either lists of transaction tuples or the (ids, offsets, covers, sizes) arrays of utils.iter_arrays)
+def preprocess_chunks(chunks):
     temp_ind, temp_cov, temp_size = {}, {}, {}
     grouped_txs = []
-    for (ind, sets, size) in txs:
-        key = ','.join([str(s) for s in sorted(sets)])
-        if key in temp_ind:
-            temp_ind[key].append(int(ind))
-            temp_size[key] += size
-        else:
-            temp_ind[key] = [int(ind)]
-            temp_cov[key] = sets
-            temp_size[key] = size
+    for chunk in chunks:
+        if isinstance(chunk, tuple):
+            chunk = arrays_to_txs(chunk)
+        for (ind, sets, size) in chunk:
+            key = ','.join([str(s) for s in sorted(sets)])
+            if key in temp_ind:
+                temp_ind[key].append(int(ind))
+                temp_size[key] += size
+            else:
+                temp_ind[key] = [int(ind)]
+                temp_cov[key] = sets
+                temp_size[key] = size
 
     for key, v in temp_ind.items():
         grouped_txs.append((v, temp_cov[key], temp_size[key]))
@@ -29,6 +41,12 @@ def preprocess_txs(txs):
 
 
 def sorted_density(covered, txs):
+    if isinstance(txs, TransactionSet):
+        # covered is the mask of covered subsets, the density is computed by popcounts
+        dens = txs.new_counts(covered) / txs.sizes
+        idx = np.argsort(dens, kind='stable')
+        return (idx.tolist(), dens[idx].tolist())
+
     dens = []
     for tx in txs:         # tx[0] is the id, tx[1] is the covered subsets and tx[2] is the size
         dens.append(len(set(tx[1])-covered)/tx[2])
@@ -39,44 +57,6 @@ def sorted_density(covered, txs):
     return (idx, sorted_dens)
 
 
-def DP_fill_core(table, ind, tx_size, c):
-    if c < 1:
-        return 0
-    if c-tx_size < 0:
-        return table[(ind-1, c)]
-
-    if table[(ind-1, c-tx_size)] + tx_size > table[(ind-1, c)]:
-        return table[(ind-1, c-tx_size)] + tx_size
-    else:
-        return table[(ind-1, c)]
-
-
-def DP_fill(candidates, capacity):
-    temp_table = dict()
-    sel = []
-    for c in range(capacity + 1):
-        if c >= candidates[0][2]:
-            temp_table[(0, c)] = candidates[0][2]
-        else:
-            temp_table[(0, c)] = 0
-
-    for ind in range(1, len(candidates)):
-        for c in range(capacity + 1):
-            temp_table[(ind, c)] = DP_fill_core(temp_table, ind, candidates[ind][2], c)
-
-    # output selections
-    c = capacity
-    for ind in range(len(candidates) - 1, -1, -1):
-        if ind > 0:
-            if (temp_table[(ind, c)] > temp_table[(ind-1, c)]):
-                sel.append(candidates[ind][0])  # index
-                c -= candidates[ind][2]     # capacity
-        elif temp_table[(ind, c)] > 0:
-            sel.append(candidates[ind][0])  # index
-
-    return sel, temp_table[(len(candidates) - 1, capacity)]
-
-
 def find_tx_by_index(txs, ind_list):
     find_txs = []
     for tx in txs:
@@ -86,16 +66,22 @@ def find_tx_by_index(txs, ind_list):
 
 
 def MinD(subsets, capacity, txs, grouped_txs):
-    covered = set()
+    # the grouped transactions are kept in a bitset container (the id of each row is its position)
+    # and the removed groups are masked out instead of being deleted from the list
+    groups = TransactionSet.from_txs([(pos, gtx[1], gtx[2]) for pos, gtx in enumerate(grouped_txs)], subsets)
+    remaining = np.ones(len(grouped_txs), dtype=bool)
+    covered = groups.mask()
     selected = []
-    minimum_cap, temp_cover = 99999999, set()
+    minimum_cap, temp_cover = 99999999, groups.mask()
     check_all = False
     temp_cap = capacity
 
     dp_candidates = []
 
-    while capacity > 0 and not check_all and len(grouped_txs) > 0:
-        (sorted_id, sorted_dens) = sorted_density(covered, grouped_txs)
+    while capacity > 0 and not check_all and remaining.any():
+        positions = np.flatnonzero(remaining)
+        (sorted_pos, sorted_dens) = sorted_density(covered, groups.take(positions))
+        sorted_id = positions[sorted_pos].tolist()
         for id in sorted_id:
             gtx = grouped_txs[id]
             if capacity >= gtx[2]:
@@ -103,15 +89,16 @@ def MinD(subsets, capacity, txs, grouped_txs):
                     selected.append(i)
                     dp_candidates += find_tx_by_index(txs, [i])
                 capacity -= gtx[2]
-                covered |= set(gtx[1])
-                grouped_txs.remove(gtx)
+                covered |= groups.bits[id]
+                remaining[id] = False
                 break
             else:
                 temp_candidate = dp_candidates + find_tx_by_index(txs, gtx[0])
-                sel, cap = DP_fill(temp_candidate, temp_cap)
+                sel, cap = bounded_fill_selections([tx[2] for tx in temp_candidate], [temp_cap])[0]
+                sel = [temp_candidate[i][0] for i in sel]
                 if (temp_cap - cap) < minimum_cap:
                     minimum_cap = (temp_cap - cap)
-                    temp_cover = set(gtx[1])
+                    temp_cover = groups.bits[id]
                     temp_selection = sel
                     if minimum_cap == 0:
                         capacity = minimum_cap
@@ -125,16 +112,17 @@ def MinD(subsets, capacity, txs, grouped_txs):
         capacity = minimum_cap
         covered |= temp_cover
         selected = temp_selection
-    objective = subsets * capacity + len(covered)
+    objective = subsets * capacity + int(popcount(covered))
     return (selected, objective)
 
 
 def run_exp(capacity, tx_count, subsets, seed, set_distribution, size_distribution, name, type=0):
     print(parse_path(tx_count, subsets, seed, set_distribution, size_distribution, real_type=type))
-    transactions = read_data(parse_path(tx_count, subsets, seed, set_distribution, size_distribution, real_type=type))
+    transactions = load_data(tx_count, subsets, seed, set_distribution, size_distribution, real_type=type)
 
     print("processing seed: {}, subsets: {}, tx_count: {}, capacity: {}".format(seed, subsets, tx_count, capacity))
-    grouped_transactions = preprocess_txs(transactions)
+    grouped_transactions = preprocess_chunks(
+        load_chunks(tx_count, subsets, seed, set_distribution, size_distribution, real_type=type))
 
     start = time.time()
     (opt_txs, objective) = MinD(subsets, capacity, transactions, grouped_transactions)
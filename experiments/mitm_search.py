@@ -0,0 +1,87 @@
+# !/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author:
+# This file implements the meet-in-the-middle search to find the optimal solution of medium-size instances
+
+from transaction_set import as_transaction_set, bit_count
+import numpy as np
+
+# the number of (A state, B state) pairs evaluated at once in the join
+JOIN_CHUNK = 1 << 22
+
+
+# enumerate the (size, cover mask, picked transactions) states of the selections within the capacity,
+# doubling the states with each transaction, the states with the same size and mask are merged
+def enumerate_half(sizes, masks, capacity):
+    state_sizes = np.zeros(1, dtype=np.int64)
+    state_masks = np.zeros(1, dtype=np.uint64)
+    state_picks = np.zeros(1, dtype=np.uint64)
+    for k, (size, mask) in enumerate(zip(sizes, masks)):
+        keep = state_sizes + size <= capacity
+        state_sizes = np.concatenate([state_sizes, state_sizes[keep] + size])
+        state_masks = np.concatenate([state_masks, state_masks[keep] | np.uint64(mask)])
+        state_picks = np.concatenate([state_picks, state_picks[keep] | np.uint64(1 << k)])
+
+    order = np.lexsort((state_masks, state_sizes))
+    state_sizes, state_masks, state_picks = state_sizes[order], state_masks[order], state_picks[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (state_sizes[1:] != state_sizes[:-1]) | (state_masks[1:] != state_masks[:-1])
+    return state_sizes[first], state_masks[first], state_picks[first]
+
+
+# drop the states whose mask is a superset of another mask of the same size (they are never better),
+# the states are sorted by size, groups larger than max_group are only deduplicated
+def prune_supersets(state_sizes, state_masks, state_picks, max_group=2048):
+    keep = np.ones(len(state_sizes), dtype=bool)
+    bounds = np.flatnonzero(np.diff(state_sizes)) + 1
+    for start, end in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(state_sizes)]])):
+        if end - start < 2 or end - start > max_group:
+            continue
+        group = state_masks[start:end]
+        # contained[i, j]: mask j is a proper subset of mask i
+        contained = ((group[None, :] & ~group[:, None]) == 0) & (group[None, :] != group[:, None])
+        keep[start:end] = ~contained.any(axis=1)
+    return state_sizes[keep], state_masks[keep], state_picks[keep]
+
+
+# the meet-in-the-middle search of min subsets * (capacity - size) + |covers| within the capacity (up to 64
+# subsets). The transactions are split into two halves whose states are enumerated and pruned. Since the
+# covers are at most subsets, one more unit of size is never worse, so an optimal selection has the max
+# fill: the first half states are joined with the second half states of the size completing the max fill
+# (if it exists), where the pair with the least covers of the union is taken
+def mitm_search(transactions, subsets, capacity):
+    transactions = as_transaction_set(transactions, subsets)
+    if transactions.subsets > 64:
+        raise ValueError('mitm_search supports up to 64 subsets, got {}'.format(transactions.subsets))
+    txs = transactions.to_txs()
+    sizes = transactions.sizes.tolist()
+    masks = transactions.bits[:, 0].tolist()
+    half = len(txs) // 2
+
+    a_sizes, a_masks, a_picks = prune_supersets(*enumerate_half(sizes[:half], masks[:half], capacity))
+    b_sizes, b_masks, b_picks = prune_supersets(*enumerate_half(sizes[half:], masks[half:], capacity))
+
+    # the group (of equal size) of the second half for each state of the first half: the largest size that
+    # fits, the states reaching the max fill are kept
+    group_sizes, group_starts = np.unique(b_sizes, return_index=True)
+    group_ends = np.append(group_starts[1:], len(b_sizes))
+    partner = np.searchsorted(group_sizes, capacity - a_sizes, side='right') - 1
+    fills = a_sizes + group_sizes[partner]
+    max_fill = int(fills.max())
+    reaching = fills == max_fill
+
+    min_covered, best = None, None
+    for g in np.unique(partner[reaching]):
+        a_index = np.flatnonzero(reaching & (partner == g))
+        b_masks_g = b_masks[group_starts[g]:group_ends[g]]
+        rows = max(1, JOIN_CHUNK // len(b_masks_g))
+        for start in range(0, len(a_index), rows):
+            chunk = a_index[start:start + rows]
+            covered = bit_count(a_masks[chunk, None] | b_masks_g[None, :])
+            i, j = np.unravel_index(int(covered.argmin()), covered.shape)
+            if min_covered is None or covered[i, j] < min_covered:
+                min_covered, best = int(covered[i, j]), (chunk[i], group_starts[g] + j)
+
+    picks = int(a_picks[best[0]]) | (int(b_picks[best[1]]) << half)
+    opt_txs = tuple(txs[t] for t in range(len(txs)) if picks >> t & 1)
+    return subsets * (capacity - max_fill) + min_covered, opt_txs
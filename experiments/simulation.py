@@ -6,70 +6,57 @@
 import argparse
 import yaml
 from pathlib import Path
-from utils import read_data, parse_path
+from utils import load_data
 from min_density import MinD, preprocess_txs
+from transaction_set import as_transaction_set
 import numpy as np
 import copy
 import time
 
 
 def split_batches(transactions, subsets, exp_block_count):
+    transactions = as_transaction_set(transactions, subsets)
+
     # compute batch capacity based on parameters
-    sum_gas = 0
-    for tx in transactions:
-        sum_gas += tx[2]
+    sum_gas = int(transactions.sizes.sum())
     capacity = int(sum_gas / exp_block_count)
     # print(capacity)
 
     # filter out the transactions that cannot fit in one batch
     # to prevent infinity loop
-    i = 0
-    while i < len(transactions):
-        tx = transactions[i]
-        if tx[2] > capacity:
-            transactions.remove(tx)
-        else:
-            i += 1
+    remaining = transactions.sizes <= capacity
 
     # continue picking up batches from the candidate transactions
     # by using MinD algorithm based on batch capacity
     batches = []
     access_counter = [0 for i in range(subsets)]
 
-    while (len(transactions) > 0):
+    while remaining.any():
         # based on the prewrite condition, select transactions that avoid the dependency
         if sum(access_counter) == access_counter[0] * subsets:
-            candidates = transactions
+            candidates = remaining
             accessable = subsets
         else:
             accessable_sets = []
             for ind in range(len(access_counter)):
                 if access_counter[ind] < max(access_counter):
                     accessable_sets.append(ind)
-            candidates, cap = [], 0
-            for tx in transactions:
-                if set(tx[1]).intersection(accessable_sets) == set(tx[1]):
-                    candidates.append(tx)
-                    cap += tx[2]
+            candidates = remaining & transactions.within(transactions.mask(accessable_sets))
+            cap = int(transactions.sizes[candidates].sum())
             # if candidates cannot fill in one batch, we allow all transactions to be selectable
             if cap < capacity:
-                candidates = transactions
+                candidates = remaining
                 accessable = subsets
             else:
                 accessable = len(accessable_sets)
 
+        candidates = transactions.take(candidates).to_txs()
         grouped_transactions = preprocess_txs(candidates)
         (opt_txs, _) = MinD(accessable, capacity, candidates, grouped_transactions)
 
-        cv = set()
-        i = 0
-        while i < len(transactions):
-            tx = transactions[i]
-            if tx[0] in opt_txs:
-                cv |= set(tx[1])
-                transactions.remove(tx)
-            else:
-                i += 1
+        picked = remaining & np.isin(transactions.ids, opt_txs)
+        cv = set(transactions.mask_to_subsets(transactions.cover_union(picked)))
+        remaining &= ~picked
 
         # maintain the access counter to each set
         for st in cv:
@@ -79,6 +66,53 @@ def split_batches(transactions, subsets, exp_block_count):
     return batches
 
 
+# pack the mempool by the MinD algorithm into one batch of the given capacity,
+# return (ids of the packed transactions, covered subsets, the remaining mempool)
+def pack_mempool(mempool, subsets, capacity):
+    opt_txs, cv = [], set()
+    if len(mempool) > 0:
+        (opt_txs, _) = MinD(subsets, capacity, mempool, preprocess_txs(mempool))
+        picked = set(opt_txs)
+        for t in mempool:
+            if t[0] in picked:
+                cv |= set(t[1])
+        mempool = [t for t in mempool if t[0] not in picked]
+    return opt_txs, cv, mempool
+
+
+# pack an online stream of (arrival time, transaction) into batches, e.g., the stream of
+# dataset/generate_synthetic_data.stream_transactions. Every block_interval, the transactions that
+# have arrived (the mempool) are packed by the MinD algorithm into one batch of the given capacity and
+# the rest wait for the next batch. Yield (batch time, ids of the packed transactions, covered subsets,
+# size of the mempool after packing), the stream stops after block_count batches if it is set. Otherwise,
+# when the stream ends, the remaining mempool is packed into the following batches until it is empty.
+def stream_batches(stream, subsets, capacity, block_interval, block_count=None):
+    mempool, produced = [], 0
+    next_block = block_interval
+
+    for (timestamp, tx) in stream:
+        while timestamp >= next_block:
+            opt_txs, cv, mempool = pack_mempool(mempool, subsets, capacity)
+            yield (next_block, opt_txs, cv, len(mempool))
+
+            produced += 1
+            if block_count is not None and produced >= block_count:
+                return
+            next_block += block_interval
+
+        # a transaction larger than the capacity can never be packed
+        if tx[2] <= capacity:
+            mempool.append(tx)
+
+    if block_count is None:
+        while len(mempool) > 0:
+            opt_txs, cv, mempool = pack_mempool(mempool, subsets, capacity)
+            yield (next_block, opt_txs, cv, len(mempool))
+            if len(opt_txs) == 0:
+                break
+            next_block += block_interval
+
+
 # pre-determine the information of each batch/block including the time to be on-chain etc.
 def batch_information(batches, f_rate, sys_info):
     timer = 0
@@ -343,9 +377,9 @@ if __name__ == '__main__':
 
                     for seed in seed_list:
                         if exp_type == 'real_data':
-                            transactions = read_data(parse_path(tx_count, subsets, seed))
+                            transactions = load_data(tx_count, subsets, seed)
                         else:
-                            transactions = read_data(parse_path(tx_count, subsets, seed, size_distribution = size_dist, zipfian=zipf))
+                            transactions = load_data(tx_count, subsets, seed, size_distribution = size_dist, zipfian=zipf)
 
                         batches = split_batches(transactions, subsets, exp_block_count)
 
@@ -0,0 +1,135 @@
+# !/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author:
+# This file implements the bitset-backed transaction container shared by the algorithms
+
+from utils import arrays_to_txs
+import numpy as np
+
+WORD_BITS = 64
+# the number of set bits of each 16-bit value
+POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+POPCOUNT_TABLE = POPCOUNT_TABLE[np.arange(1 << 16) & 255] + POPCOUNT_TABLE[np.arange(1 << 16) >> 8]
+
+
+# count the set bits of each uint64 word (with np.bitwise_count when numpy has it)
+def bit_count(words):
+    words = np.ascontiguousarray(words, dtype=np.uint64)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    return POPCOUNT_TABLE[words.view(np.uint16)].reshape(words.shape + (4,)).sum(axis=-1)
+
+
+# count the set bits of uint64 words along the last axis
+def popcount(words):
+    return bit_count(words).sum(axis=-1, dtype=np.int64)
+
+
+class TransactionSet:
+    # each transaction is stored as one row of a packed uint64 bitmap (bit i = subset i)
+    # together with its id and size, the covered subsets are also kept in the CSR form
+    # (offsets, covers) to provide the (id, [covered subsets], size) view
+    def __init__(self, ids, offsets, covers, sizes, subsets=None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.covers = np.asarray(covers, dtype=np.int64)
+        self.sizes = np.asarray(sizes, dtype=np.int64)
+        if len(self.covers) > 0:
+            subsets = max(subsets or 0, int(self.covers.max()) + 1)
+        self.subsets = subsets or 1
+        self.words = (self.subsets + WORD_BITS - 1) // WORD_BITS
+
+        self.bits = np.zeros((len(self.ids), self.words), dtype=np.uint64)
+        rows = np.repeat(np.arange(len(self.ids)), np.diff(self.offsets))
+        np.bitwise_or.at(self.bits, (rows, self.covers // WORD_BITS),
+                         np.left_shift(np.uint64(1), (self.covers % WORD_BITS).astype(np.uint64)))
+        self._txs = None
+
+    @classmethod
+    def from_txs(cls, txs, subsets=None):
+        ids, offsets, covers, sizes = [], [0], [], []
+        for (ind, sets, size) in txs:
+            ids.append(ind)
+            covers.extend(sets)
+            offsets.append(len(covers))
+            sizes.append(size)
+        return cls(ids, offsets, covers, sizes, subsets)
+
+    @classmethod
+    def from_arrays(cls, data, subsets=None):
+        ids, offsets, covers, sizes = data
+        return cls(ids, offsets, covers, sizes, subsets)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.to_txs())
+
+    def __getitem__(self, ind):
+        return self.to_txs()[ind]
+
+    # the list of (id, [covered subsets], size) tuples, built once
+    def to_txs(self):
+        if self._txs is None:
+            self._txs = arrays_to_txs((self.ids, self.offsets, self.covers, self.sizes))
+        return self._txs
+
+    def take(self, selection):
+        selection = self._positions(selection)
+        starts = self.offsets[selection]
+        lengths = self.offsets[selection + 1] - starts
+        offsets = np.zeros(len(selection) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        gather = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return TransactionSet(self.ids[selection], offsets, self.covers[gather], self.sizes[selection], self.subsets)
+
+    # the mask (one row of words) of the given subsets
+    def mask(self, sets=()):
+        mask = np.zeros(self.words, dtype=np.uint64)
+        for s in sets:
+            mask[s // WORD_BITS] |= np.uint64(1) << np.uint64(s % WORD_BITS)
+        return mask
+
+    # the covered subsets of each transaction as the bits of a Python integer
+    def int_masks(self):
+        words = self.bits.tolist()
+        return [sum(word << (w * WORD_BITS) for w, word in enumerate(row)) for row in words]
+
+    # the positions of the transactions covering each subset
+    def subset_index(self):
+        rows = np.repeat(np.arange(len(self.ids)), np.diff(self.offsets))
+        order = np.argsort(self.covers, kind='stable')
+        bounds = np.searchsorted(self.covers[order], np.arange(self.subsets + 1))
+        return [rows[order[bounds[s]:bounds[s + 1]]].tolist() for s in range(self.subsets)]
+
+    # the subsets contained in a mask
+    def mask_to_subsets(self, mask):
+        bits = np.unpackbits(np.ascontiguousarray(mask, dtype=np.uint64).view(np.uint8), bitorder='little')
+        return np.flatnonzero(bits[:self.subsets]).tolist()
+
+    # the union of the covered subsets of the selected transactions (all by default)
+    def cover_union(self, selection=None):
+        rows = self.bits if selection is None else self.bits[self._positions(selection)]
+        return np.bitwise_or.reduce(rows, axis=0) if len(rows) > 0 else self.mask()
+
+    # the number of covered subsets of each transaction that are not in the covered mask
+    def new_counts(self, covered):
+        return popcount(self.bits & ~covered)
+
+    # whether the covered subsets of each transaction are all in the accessible mask
+    def within(self, accessible):
+        return ~np.any(self.bits & ~accessible, axis=1)
+
+    def _positions(self, selection):
+        selection = np.asarray(selection)
+        if selection.dtype == bool:
+            return np.flatnonzero(selection)
+        return selection.astype(np.int64).reshape(-1)
+
+
+# let the algorithms accept both the TransactionSet and the list of transaction tuples
+def as_transaction_set(txs, subsets=None):
+    if isinstance(txs, TransactionSet):
+        return txs
+    return TransactionSet.from_txs(txs, subsets)
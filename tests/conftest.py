@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# the scripts import each other as top-level modules (see experiments/*.py)
+root = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(root), str(root / 'experiments')]
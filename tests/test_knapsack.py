@@ -0,0 +1,61 @@
+import random
+import time
+
+import pytest
+
+from knapsack import approx_fill_selection, bounded_fill_selections, max_fill
+
+
+@pytest.mark.parametrize('sizes, capacity, eps', [
+    ([600] * 4, 1805, 0.3),
+    ([5, 1757, 2914, 179, 10, 79, 9, 2779], 1805, 0.3),
+])
+def test_approx_fill_examples(sizes, capacity, eps):
+    selected, filled, bound = approx_fill_selection(sizes, capacity, eps)
+    opt = max_fill(sizes, capacity)
+    assert filled == sum(sizes[i] for i in selected) <= capacity
+    assert opt - filled <= eps * capacity
+    assert opt <= bound <= capacity
+
+
+def test_approx_fill_against_exact():
+    rng = random.Random(0)
+    for _ in range(500):
+        capacity = rng.randint(1, 3000)
+        eps = rng.choice([0.01, 0.1, 0.3, 0.9])
+        sizes = [rng.choice([rng.randint(1, 50), rng.randint(1, capacity + 200)]) for _ in range(rng.randint(1, 20))]
+        order = rng.sample(range(len(sizes)), len(sizes))
+        selected, filled, bound = approx_fill_selection(sizes, capacity, eps, order)
+        opt = max_fill(sizes, capacity)
+        assert len(set(selected)) == len(selected)
+        assert filled == sum(sizes[i] for i in selected) <= capacity
+        assert opt - filled <= eps * capacity
+        assert opt <= bound <= capacity
+
+
+def test_approx_fill_large_capacity():
+    rng = random.Random(1)
+    for _ in range(100):
+        capacity = rng.randint(10000, 200000)
+        eps = rng.choice([0.02, 0.05, 0.1])
+        sizes = [rng.choice([rng.randint(1, 500), rng.randint(1, capacity)]) for _ in range(rng.randint(1, 40))]
+        selected, filled, bound = approx_fill_selection(sizes, capacity, eps)
+        opt = max_fill(sizes, capacity)
+        assert filled == sum(sizes[i] for i in selected) <= capacity
+        assert opt - filled <= eps * capacity
+        assert opt <= bound <= capacity
+
+
+def test_approx_fill_faster_than_exact():
+    rng = random.Random(2)
+    capacity, eps = 1250000, 0.05
+    sizes = [rng.randint(100, 3000) for _ in range(5000)] + [rng.randint(1, capacity // 3) for _ in range(30)]
+    start = time.time()
+    selected, filled, bound = approx_fill_selection(sizes, capacity, eps)
+    approx_time = time.time() - start
+    start = time.time()
+    opt = bounded_fill_selections(sizes, [capacity])[0][1]
+    exact_time = time.time() - start
+    assert opt - filled <= eps * capacity
+    assert opt <= bound <= capacity
+    assert approx_time * 10 < exact_time
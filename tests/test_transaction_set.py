@@ -0,0 +1,13 @@
+from transaction_set import TransactionSet
+from min_density import MinD
+
+
+def test_empty_transaction_set():
+    empty = TransactionSet.from_txs([])
+    assert len(empty) == 0
+    assert empty.subsets == 1 and empty.words == 1
+    assert empty.cover_union().tolist() == [0]
+
+
+def test_min_density_without_groups():
+    assert MinD(8, 100, [], []) == ([], 8 * 100)
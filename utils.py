@@ -3,37 +3,169 @@
 # Author:
 # This file implements utility functions
 
+import numpy as np
+import hashlib
+import json
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
 
+# the binary transaction store is written next to each csv file (same name, .bin suffix)
+# layout: an int64 header [magic, version, tx count, cover count, csv mtime, 0, 0, 0],
+# then ids (int64), CSR offsets (int64, tx count + 1), sizes (int64) and the flat covers (int32)
+BINARY_MAGIC = 0x43415442
+BINARY_VERSION = 1
+BINARY_HEADER = 8
 
+
+# txs is either the list of lines in the format of id;covers;size or the (ids, offsets, covers, sizes) arrays
 def save_data(txs, path):
     print(path.absolute())
     if path.exists():
         print('The file exists!')
     else:
+        if isinstance(txs, tuple):
+            data, txs = txs, format_txs(txs)
+            if is_real_path(path):
+                data = data[:3] + ((data[3] / 1000).astype(np.int64),)
+        else:
+            data = parse_txs(txs, is_real_path(path))
         with open(path, "w", newline='\n') as file:
             file.writelines(txs)
+        save_binary(data, binary_path(path), path.stat().st_mtime_ns)
         print("Done!")
     return
 
 
-def read_data(path):
-    txs = []
+def is_real_path(path):
+    # the size of real transactions is stored as gas and converted to the unit of 1000 gas
+    return 'real' in str(path)
+
+
+def binary_path(path):
+    return Path(path).with_suffix('.bin')
+
+
+# parse the lines in the format of id;covers;size into (ids, offsets, covers, sizes) arrays
+def parse_txs(lines, real=False):
+    ids, offsets, covers, sizes = [], [0], [], []
+    for line in lines:
+        temp = line.split(';')
+        ids.append(int(temp[0]))
+        covers.extend(int(i) for i in temp[1].split(','))
+        offsets.append(len(covers))
+        if real:
+            sizes.append(int(int(temp[2]) / 1000))
+        else:
+            sizes.append(int(temp[2]))
+    return (np.array(ids, dtype=np.int64), np.array(offsets, dtype=np.int64),
+            np.array(covers, dtype=np.int32), np.array(sizes, dtype=np.int64))
+
+
+# format the (ids, offsets, covers, sizes) arrays into lines in the format of id;covers;size
+def format_txs(data):
+    ids, offsets, covers, sizes = data
+    ids, offsets, sizes = ids.tolist(), np.asarray(offsets).tolist(), sizes.tolist()
+    covers = np.asarray(covers).astype(str).tolist()
+    return ['{};{};{}\n'.format(ids[i], ','.join(covers[offsets[i]:offsets[i + 1]]), sizes[i])
+            for i in range(len(ids))]
+
+
+def save_binary(data, path, mtime_ns=0):
+    ids, offsets, covers, sizes = data
+    header = np.zeros(BINARY_HEADER, dtype=np.int64)
+    header[:5] = [BINARY_MAGIC, BINARY_VERSION, len(ids), len(covers), mtime_ns]
+    with open(path, "wb") as file:
+        for array, dtype in ((header, np.int64), (ids, np.int64), (offsets, np.int64),
+                             (sizes, np.int64), (covers, np.int32)):
+            file.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+
+
+# memory-map the binary store, return None if it is missing, broken or older than the csv file
+def load_binary(path, mtime_ns=None):
+    if not path.exists() or path.stat().st_size < BINARY_HEADER * 8:
+        return None
+    header = np.fromfile(path, dtype=np.int64, count=BINARY_HEADER)
+    if header[0] != BINARY_MAGIC or header[1] != BINARY_VERSION:
+        return None
+    if mtime_ns is not None and header[4] != mtime_ns:
+        return None
+    n, nnz = int(header[2]), int(header[3])
+    if path.stat().st_size != 8 * (BINARY_HEADER + 3 * n + 1) + 4 * nnz:
+        return None
+
+    arrays, offset = [], 8 * BINARY_HEADER
+    for dtype, count in ((np.int64, n), (np.int64, n + 1), (np.int64, n), (np.int32, nnz)):
+        if count > 0:
+            arrays.append(np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,)))
+        else:
+            arrays.append(np.zeros(count, dtype=dtype))
+        offset += np.dtype(dtype).itemsize * count
+    ids, offsets, sizes, covers = arrays
+    return ids, offsets, covers, sizes
+
+
+# load the (ids, offsets, covers, sizes) arrays of a dataset, the csv file is parsed only
+# when the binary store does not exist yet (or is stale), and the store is written afterwards
+def read_arrays(path):
+    path = Path(path)
+    mtime_ns = path.stat().st_mtime_ns
+    data = load_binary(binary_path(path), mtime_ns)
+    if data is not None:
+        return data
+
     with open(path) as file:
-        lines = file.readlines()
-        for line in lines:
-            temp = line.split(';')
-            id = int(temp[0])
-            covers = [int(i) for i in temp[1].split(',')]
-            if 'real' in str(path):
-                size = int(int(temp[2]) / 1000)
-            else:
-                size = int(temp[2])
-            txs.append((id, covers, size))
-        print('finish reading the file!')
+        data = parse_txs(file, is_real_path(path))
+    try:
+        save_binary(data, binary_path(path), mtime_ns)
+    except OSError:
+        print('cannot write the binary store of {}'.format(path))
+    return data
+
+
+# convert the arrays into the list of (id, [covered subsets], size) tuples used by the algorithms
+def arrays_to_txs(data):
+    ids, offsets, covers, sizes = data
+    ids, offsets, covers, sizes = ids.tolist(), offsets.tolist(), covers.tolist(), sizes.tolist()
+    return [(ids[i], covers[offsets[i]:offsets[i + 1]], sizes[i]) for i in range(len(ids))]
+
+
+def read_data(path):
+    txs = arrays_to_txs(read_arrays(path))
+    print('finish reading the file!')
     return txs
 
 
+# iterate the dataset in chunks of at most chunk_size transactions, each chunk is a tuple of
+# (ids, offsets, covers, sizes) arrays whose offsets start from 0, so the memory is bounded by the chunk
+def iter_data(path, chunk_size=65536):
+    path = Path(path)
+    data = load_binary(binary_path(path), path.stat().st_mtime_ns)
+    if data is not None:
+        yield from iter_arrays(data, chunk_size)
+        return
+
+    real = is_real_path(path)
+    with open(path) as file:
+        while True:
+            lines = list(islice(file, chunk_size))
+            if not lines:
+                break
+            yield parse_txs(lines, real)
+
+
+# slice the (ids, offsets, covers, sizes) arrays (loaded or memory-mapped) into chunks of at most
+# chunk_size transactions in the format of iter_data
+def iter_arrays(data, chunk_size=65536):
+    ids, offsets, covers, sizes = data
+    for start in range(0, len(ids), chunk_size):
+        end = min(start + chunk_size, len(ids))
+        yield (np.array(ids[start:end]), np.array(offsets[start:end + 1]) - offsets[start],
+               np.array(covers[offsets[start]:offsets[end]]), np.array(sizes[start:end]))
+
+
 def parse_path(tx_count, subsets, seed, set_distribution = None, size_distribution = None, real_type=0, zipfian = -1):
     if set_distribution and size_distribution:
         root_path = Path('../dataset/synthetic').resolve()
@@ -54,5 +186,132 @@ def parse_path(tx_count, subsets, seed, set_distribution = None, size_distributi
         return path
 
 
+# in-process LRU cache of the parsed datasets, keyed by the parse_path arguments, an entry is
+# reloaded when the mtime of the csv file changes and the least recently used entries are evicted
+# once the arrays exceed max_bytes. The persistent layer is the binary store next to each csv file,
+# so other scripts (and later runs) load the parsed arrays instead of parsing the csv again.
+# The list of transaction tuples of an entry is built on its first load_data and kept with the arrays,
+# its Python objects count towards max_bytes too (several times the bytes of the arrays).
+class DatasetCache:
+    def __init__(self, max_bytes=1 << 30):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = OrderedDict()     # key : (mtime, arrays)
+        self.txs = dict()                # key : (list of (id, [covered subsets], size), bytes of the list)
+
+    def get(self, key, path):
+        mtime_ns = Path(path).stat().st_mtime_ns
+        if key in self.entries:
+            if self.entries[key][0] == mtime_ns:
+                self.entries.move_to_end(key)
+                return self.entries[key][1]
+            self.evict(key)
+
+        data = tuple(np.array(array) for array in read_arrays(path))
+        self.entries[key] = (mtime_ns, data)
+        self.nbytes += sum(array.nbytes for array in data)
+        self.shrink()
+        return data
+
+    # the transaction tuples of the entry, a new list is returned so the callers may reorder it
+    def get_txs(self, key, path):
+        data = self.get(key, path)
+        if key not in self.txs:
+            txs = arrays_to_txs(data)
+            self.txs[key] = (txs, txs_nbytes(txs))
+            self.nbytes += self.txs[key][1]
+            self.shrink()
+        return list(self.txs[key][0])
+
+    # evict the least recently used entries until the cache fits in max_bytes (the last entry is kept)
+    def shrink(self):
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            self.evict(next(iter(self.entries)))
+
+    def evict(self, key):
+        _, data = self.entries.pop(key)
+        if key in self.txs:
+            self.nbytes -= self.txs.pop(key)[1]
+        self.nbytes -= sum(array.nbytes for array in data)
+
+    def clear(self):
+        self.entries.clear()
+        self.txs.clear()
+        self.nbytes = 0
+
+
+dataset_cache = DatasetCache()
+
+
+# the bytes of the Python objects of a list of (id, [covered subsets], size) tuples
+def txs_nbytes(txs):
+    nbytes = sys.getsizeof(txs)
+    for (ind, sets, size) in txs:
+        nbytes += sys.getsizeof((ind, sets, size)) + sys.getsizeof(ind) + sys.getsizeof(size) + sys.getsizeof(sets)
+        nbytes += sum(sys.getsizeof(s) for s in sets)
+    return nbytes
+
+
+# the key of the dataset described by the parse_path arguments in the dataset cache
+def cache_key(tx_count, subsets, seed, set_distribution, size_distribution, real_type, zipfian):
+    return (tx_count, subsets, seed, str(set_distribution), str(size_distribution), real_type, zipfian)
+
+
+# the cached (ids, offsets, covers, sizes) arrays of the dataset described by the parse_path arguments
+def load_arrays(tx_count, subsets, seed, set_distribution = None, size_distribution = None, real_type=0, zipfian = -1):
+    path = parse_path(tx_count, subsets, seed, set_distribution, size_distribution, real_type, zipfian)
+    return dataset_cache.get(cache_key(tx_count, subsets, seed, set_distribution, size_distribution, real_type, zipfian), path)
+
+
+# the cached arrays of load_arrays in chunks of at most chunk_size transactions (see iter_arrays)
+def load_chunks(tx_count, subsets, seed, set_distribution = None, size_distribution = None, real_type=0, zipfian = -1,
+                chunk_size=65536):
+    return iter_arrays(load_arrays(tx_count, subsets, seed, set_distribution, size_distribution, real_type, zipfian),
+                       chunk_size)
+
+
+# the cached version of read_data(parse_path(...))
+def load_data(tx_count, subsets, seed, set_distribution = None, size_distribution = None, real_type=0, zipfian = -1):
+    path = parse_path(tx_count, subsets, seed, set_distribution, size_distribution, real_type, zipfian)
+    txs = dataset_cache.get_txs(cache_key(tx_count, subsets, seed, set_distribution, size_distribution, real_type, zipfian), path)
+    print('finish reading the file!')
+    return txs
+
+
+# the SeedSequence of a generation task: the seed mixed with a stable hash of the parameters of the task, so
+# the generated file only depends on the seed and the parameters encoded in its name (not on the sweep it is
+# generated in)
+def task_seed(seed, params):
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).digest()
+    return np.random.SeedSequence([seed] + np.frombuffer(digest, dtype=np.uint32).tolist())
+
+
+# run the dataset generation tasks, each task is (function, kwargs, output paths). The tasks writing the
+# same files are merged (the first one is kept) and the tasks whose files all exist are skipped up front.
+# With a seed, each task gets an rng kwarg: task_seed of the seed and the other kwargs of the task, so the
+# generated files do not depend on the number of workers or on the other tasks.
+def run_tasks(tasks, workers=1, seed=None):
+    unique, seen = [], set()
+    for func, kwargs, paths in tasks:
+        key = tuple(str(p) for p in paths)
+        if key not in seen:
+            seen.add(key)
+            unique.append((func, kwargs, paths))
+    if seed is not None:
+        unique = [(func, dict(kwargs, rng=task_seed(seed, {k: v for k, v in kwargs.items() if k not in ('seed', 'rng')})),
+                   paths) for func, kwargs, paths in unique]
+
+    pending = [(func, kwargs) for func, kwargs, paths in unique if not all(Path(p).exists() for p in paths)]
+    print('generating {} of {} files'.format(len(pending), len(unique)))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(func, **kwargs) for func, kwargs in pending]
+            for future in futures:
+                future.result()
+    else:
+        for func, kwargs in pending:
+            func(**kwargs)
+
+
 if __name__ == '__main__':
     print("utils.py")